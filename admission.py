@@ -0,0 +1,88 @@
+import threading
+import time
+
+# Question budget per user: a bucket of BURST tokens refilled at RATE tokens a
+# second. A question takes its estimated cost in tokens (see
+# analytics.question_cost): 1 for a cached or cheap answer, more for scans.
+RATE = 1.0
+BURST = 20.0
+# Questions that would have to wait longer than this for tokens are turned away
+MAX_WAIT = 15.0
+# Buckets kept before idle (full) ones are dropped
+MAX_BUCKETS = 10_000
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, cost):
+        """Seconds until `cost` tokens are available"""
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Per-user token buckets pacing how often each user's questions start
+
+    A question that finds too few tokens is not refused outright: it takes
+    them on credit and is delayed until the bucket has refilled, unless that
+    would take longer than `max_wait`.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST, max_wait=MAX_WAIT):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._buckets = {}
+        self._delayed = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, user, cost):
+        """Take `cost` tokens from `user`'s bucket
+
+        Returns (admitted, seconds): the delay before the question may start,
+        or for a refused one how long until it would be admitted. Questions
+        costing more than a full bucket are charged a full bucket.
+        """
+        now = time.monotonic()
+        cost = min(cost, self.burst)
+        with self._lock:
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                self._prune(now)
+                bucket = self._buckets[user] = TokenBucket(self.rate, self.burst, now)
+            bucket.refill(now)
+            wait = bucket.wait(cost)
+            if wait > self.max_wait:
+                self._rejected += 1
+                return False, wait - self.max_wait
+            bucket.tokens -= cost
+            if wait:
+                self._delayed += 1
+            return True, wait
+
+    def refund(self, user, cost):
+        """Give back tokens of a question that was admitted but never ran"""
+        with self._lock:
+            bucket = self._buckets.get(user)
+            if bucket is not None:
+                bucket.tokens = min(self.burst, bucket.tokens + min(cost, self.burst))
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._buckets), "delayed": self._delayed, "rejected": self._rejected}
+
+    def _prune(self, now):
+        if len(self._buckets) < MAX_BUCKETS:
+            return
+        for user in [user for user, bucket in self._buckets.items()
+                     if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst]:
+            del self._buckets[user]
@@ -0,0 +1,759 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import metrics
+from approximate import MARGIN_SUFFIX, approximates, estimate_plan, sample_of
+from charts import MAX_CHART_POINTS, prepare_chart_data
+from dataset_engine import InMemoryBackend, RollupCache
+from intents import IntentRouter
+from planner import (
+    COST_ROWS, DEFAULT_AGG, GRAIN_LABELS, GRAIN_NAMES, MERGEABLE_AGGS, PERIOD_KEY, complete_plan,
+    defaults_available, describe_range, is_compatible, parse_plan, period_label, plan_code, plan_cost, plan_key,
+    plan_keys, run_plan, scan_plan, uses_time_index,
+)
+
+
+def estimate_size(value):
+    """Rough memory footprint of a cached value in bytes"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, tuple):
+        return sum(estimate_size(item) for item in value)
+    if hasattr(value, "nbytes"):
+        # Arrow tables and numpy arrays
+        return int(value.nbytes)
+    if hasattr(value, "to_plotly_json"):
+        # Figures: dominated by their trace arrays
+        size = 4096
+        for trace in value.data:
+            for values in trace.to_plotly_json().values():
+                if hasattr(values, "__len__") and not isinstance(values, (str, dict)):
+                    size += 16 * len(values)
+        return size
+    return len(json.dumps(value, default=str))
+
+
+class ResultCache:
+    """Process-wide LRU shared across sessions, bounded by size and entry age
+
+    Entries are tagged with their dataset and version so a reload can drop
+    the stale ones at once; hit/miss/eviction counters are kept for monitoring.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build, dataset=None, version=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or now - entry["created"] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["value"]
+            self.misses += 1
+        value = build()
+        size = estimate_size(value)
+        with self._lock:
+            self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = {
+                    "value": value, "size": size, "dataset": dataset, "version": version, "created": now,
+                }
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (self.ttl is None or time.monotonic() - entry["created"] < self.ttl)
+
+    def invalidate(self, dataset=None, before=None):
+        """Drop every entry for `dataset` (all entries when None)
+
+        With `before`, only entries built for an older version are dropped.
+        """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if self._stale(entry, dataset, before)]:
+                self._remove(key)
+
+    @staticmethod
+    def _stale(entry, dataset, before):
+        if dataset is not None and entry["dataset"] != dataset:
+            return False
+        return before is None or entry["version"] is None or entry["version"] < before
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+
+# Built figures/tables and whole responses, keyed on dataset version
+built_results = ResultCache(max_bytes=64 * 1024 * 1024)
+responses = ResultCache(max_bytes=16 * 1024 * 1024, ttl=60 * 60)
+# Table pages, as sorted/filtered/paged on the server
+pages = ResultCache(max_bytes=32 * 1024 * 1024)
+
+
+for _name, _cache in (("results", built_results), ("responses", responses), ("pages", pages)):
+    metrics.gauge("cognichat_cache_hit_rate", lambda cache=_cache: cache.stats()["hit_rate"],
+                  "Share of lookups answered from the cache", cache=_name)
+    metrics.gauge("cognichat_cache_bytes", lambda cache=_cache: cache.stats()["bytes"],
+                  "Approximate size of the cached values", cache=_name)
+    metrics.gauge("cognichat_cache_evictions", lambda cache=_cache: cache.stats()["evictions"],
+                  "Entries evicted to stay within the size budget", cache=_name)
+
+
+def invalidate_dataset(name, version=None):
+    """Forget cached results for a dataset, e.g. after it was reloaded
+
+    With `version`, results already built for that version (or a later one)
+    are kept: they may have been computed while the reload listeners ran.
+    """
+    built_results.invalidate(name, version)
+    responses.invalidate(name, version)
+    pages.invalidate(name, version)
+
+
+def make_result(rollups, query, chart=None):
+    """Compact, serializable descriptor of an answer
+
+    `query` is the completed query plan the answer is built from (see
+    planner), or `{"head": n}` for a sample of raw rows. `chart` is a chart
+    spec (type, title, labels...).
+    """
+    return {
+        "dataset": rollups.name,
+        "version": rollups.version,
+        "query": query,
+        "chart": chart,
+    }
+
+
+def _result_key(result, part):
+    spec = json.dumps({"query": result["query"], "chart": result["chart"]}, sort_keys=True, default=str)
+    return (part, result["dataset"], result["version"], spec)
+
+
+def result_frame(result, rollups):
+    """Build (or reuse) the table for a result descriptor"""
+    return built_results.get_or_build(
+        _result_key(result, "table"), lambda: _build_frame(result["query"], rollups),
+        result["dataset"], result["version"],
+    )
+
+
+def result_figure(result, rollups):
+    """Build (or reuse) the Plotly figure for a result descriptor"""
+    if not result["chart"]:
+        return None
+    return built_results.get_or_build(
+        _result_key(result, "chart"), lambda: _build_figure(result, rollups),
+        result["dataset"], result["version"],
+    )
+
+
+def _table_source(result, rollups):
+    # Raw-row results page through the dataset itself, aggregates through their frame
+    if "head" in result["query"]:
+        return rollups.backend
+    return InMemoryBackend(result_frame(result, rollups).reset_index())
+
+
+def table_columns(result, rollups):
+    """Column -> dtype of a result's table, for sorting and filtering"""
+    return _table_source(result, rollups).dtypes
+
+
+def table_page(result, rollups, page=0, page_size=20, sort=None, descending=False, filters=None):
+    """One page of a result's table, sorted and filtered on the server
+
+    Returns (rows, total matching rows); rows is a DataFrame or an Arrow
+    table. Pages are cached, so paging back and forth is free.
+    """
+    filters = filters or {}
+    spec = json.dumps([page, page_size, sort, descending, filters], sort_keys=True, default=str)
+    return pages.get_or_build(
+        _result_key(result, "page") + (spec,),
+        lambda: _table_source(result, rollups).page(filters, sort, descending, page * page_size, page_size),
+        result["dataset"], result["version"],
+    )
+
+
+def filter_value(value, dtype):
+    """A filter value converted to a column's dtype; raises ValueError if it is not one"""
+    dtype = pd.api.types.pandas_dtype(dtype)
+    if pd.api.types.is_bool_dtype(dtype):
+        if value.lower() not in ('true', 'false'):
+            raise ValueError(value)
+        return value.lower() == 'true'
+    if pd.api.types.is_integer_dtype(dtype):
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(value)
+        return int(number)
+    if pd.api.types.is_float_dtype(dtype):
+        return float(value)
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return pd.Timestamp(value)
+    return value
+
+
+def parse_table_filter(text, dtypes):
+    """Parse "Column = value, value; Column = value" into a filters dict
+
+    `dtypes` maps the table's columns to their dtypes (see table_columns);
+    values are converted to their column's type so every backend matches
+    them alike. Returns (filters, error message or None).
+    """
+    filters = {}
+    for clause in filter(None, (part.strip() for part in text.split(';'))):
+        column, _, values = clause.partition('=')
+        column = next((name for name in dtypes if name.lower() == column.strip().lower()), None)
+        if column is None or not values.strip():
+            return {}, f"Use 'Column = value, value' with one of: {', '.join(dtypes)}"
+        parsed = []
+        for value in values.split(','):
+            try:
+                parsed.append(filter_value(value.strip(), dtypes[column]))
+            except ValueError:
+                return {}, f"'{value.strip()}' is not a valid {column} value ({dtypes[column]})"
+        filters[column] = parsed
+    return filters, None
+
+
+@metrics.timed("table")
+def _build_frame(query, rollups):
+    if "head" in query:
+        return rollups.backend.head(query["head"])
+
+    # Approximate plans are estimated from the dataset's sample, see approximate
+    frame = estimate_plan(query, rollups) if query.get("approximate") else run_plan(query, rollups)
+    if query["time"]:
+        frame = frame.rename(index=str, level=0) if frame.index.nlevels > 1 else frame.set_axis(frame.index.astype(str))
+    return frame
+
+
+@metrics.timed("figure")
+def _build_figure(result, rollups):
+    chart = result["chart"]
+    query = result["query"]
+    data = result_frame(result, rollups).reset_index()
+    keys, measure = plan_keys(query), query["measures"][0]
+    dimension = keys[0]
+    color = keys[1] if len(keys) > 1 else None
+    labels = chart.get("labels", {})
+    # Approximate answers draw their confidence intervals as error bars
+    error = measure + MARGIN_SUFFIX if measure + MARGIN_SUFFIX in data else None
+    # Large series are downsampled and long category lists folded into "Other"
+    data, note, webgl = prepare_chart_data(data, chart, query)
+    title = chart["title"] + note
+
+    if chart["type"] == "line":
+        fig = px.line(data, x=dimension, y=measure, color=color, error_y=error, title=title, template="plotly_dark",
+                      labels=labels, render_mode="webgl" if webgl else "auto")
+    elif chart["type"] == "pie":
+        fig = px.pie(data, values=measure, names=dimension, title=title, template="plotly_dark")
+    elif chart.get("orientation") == "h":
+        fig = px.bar(data, x=measure, y=dimension, color=color, error_x=error, orientation='h', title=title,
+                     template="plotly_dark", labels=labels)
+    else:
+        fig = px.bar(data, x=dimension, y=measure, color=color, error_y=error, barmode='group', title=title,
+                     template="plotly_dark", labels=labels)
+    fig.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        meta={"points": len(data), "max_points": MAX_CHART_POINTS},
+    )
+    return fig
+
+
+def describe_filters(plan):
+    """Human readable filter suffix, e.g. ' (Region: North)' or ' (Q3 2024)'"""
+    if not plan["filters"]:
+        return ""
+    parts = [
+        describe_range(values) if isinstance(values, dict) else f"{column.replace('_', ' ')}: {', '.join(map(str, values))}"
+        for column, values in plan["filters"].items()
+    ]
+    return f" ({'; '.join(parts)})"
+
+
+def format_value(plan, value):
+    if plan["measures"][0] == 'Revenue' and plan["agg"] not in ('size', 'count', 'nunique'):
+        return f"${value:,.2f}"
+    if float(value).is_integer():
+        return f"{int(value):,}"
+    return f"{value:,.2f}"
+
+
+def rank_label(plan, top="Top", bottom="Bottom"):
+    """How to name the first row of a sorted answer: `bottom` when sorted ascending"""
+    return bottom if plan["sort"] == "asc" else top
+
+
+def plus_minus(plan, frame, measure, label=None):
+    """' ± $1,234.56' after a value of an approximate answer, '' for exact ones
+
+    `label` is the row of the value; None means the column total, whose
+    margin treats the rows' estimates as independent.
+    """
+    column = measure + MARGIN_SUFFIX
+    if column not in frame:
+        return ""
+    margin = np.sqrt((frame[column] ** 2).sum()) if label is None else frame[column].loc[label]
+    if pd.isna(margin):
+        return ""
+    return f" ± {format_value(plan, margin)}"
+
+
+def no_records(heading, result, plan):
+    """Answer for a plan whose filters match no rows, e.g. a year before the data starts"""
+    return {
+        "role": "assistant",
+        "content": f"{heading} no records in this range.",
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+REVENUE_WORDS = ['revenue', 'sales', 'income', 'earnings']
+CATEGORY_WORDS = ['category', 'product']
+TOP_WORDS = ['top', 'best', 'highest']
+
+router = IntentRouter()
+
+
+@router.intent("revenue_trend", {
+    "revenue": (REVENUE_WORDS, 1.0),
+    "time": (['trend', 'time', 'month', 'monthly', 'over'], 1.5),
+}, required=["revenue", "time"], defaults={"measures": ["Revenue"], "agg": "sum", "time": "Date", "grain": "M"})
+def revenue_trend(query, plan, rollups, max_rows):
+    """Revenue trend over time"""
+    grain_label = GRAIN_LABELS[plan["grain"]]
+    result = make_result(rollups, plan, {"type": "line", "title": f"{grain_label} Revenue Trend{describe_filters(plan)}"})
+    frame = result_frame(result, rollups)
+    if not len(frame):
+        return no_records(f"📈 **Revenue Analysis{describe_filters(plan)}:**", result, plan)
+    trend_revenue = frame['Revenue']
+
+    total_revenue = trend_revenue.sum()
+    avg_revenue = trend_revenue.mean()
+
+    return {
+        "role": "assistant",
+        "content": f"📈 **Revenue Analysis{describe_filters(plan)}:**\n\n• **Total Revenue:** ${total_revenue:,.2f}{plus_minus(plan, frame, 'Revenue')}\n• **Average {grain_label}:** ${avg_revenue:,.2f}\n• **Best Period:** {trend_revenue.idxmax()}",
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+@router.intent("category_revenue", {
+    "revenue": (REVENUE_WORDS, 1.0),
+    "category": (CATEGORY_WORDS, 1.5),
+}, required=["revenue", "category"], defaults={"measures": ["Revenue"], "agg": "sum", "dimensions": ["Product_Category"], "sort": "desc"})
+def category_revenue(query, plan, rollups, max_rows):
+    """Revenue by category"""
+    result = make_result(
+        rollups, plan,
+        {"type": "bar", "orientation": "h", "title": f"Revenue by Product Category{describe_filters(plan)}",
+         "labels": {"Product_Category": "Category"}},
+    )
+    frame = result_frame(result, rollups)
+    if not len(frame):
+        return no_records(f"💰 **Revenue by Category{describe_filters(plan)}:**", result, plan)
+    category_revenue = frame['Revenue']
+
+    return {
+        "role": "assistant",
+        "content": f"💰 **Revenue by Category{describe_filters(plan)}:**\n\n{rank_label(plan, 'Top', 'Lowest')} performer: **{category_revenue.index[0]}** (${category_revenue.iloc[0]:,.2f}{plus_minus(plan, frame, 'Revenue', category_revenue.index[0])})",
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+@router.intent("top_categories", {
+    "top": (TOP_WORDS, 1.0),
+    "category": (CATEGORY_WORDS, 1.5),
+    "revenue": (REVENUE_WORDS, 0.5),
+}, required=["top", "category"], defaults={"measures": ["Revenue"], "agg": "sum", "dimensions": ["Product_Category"], "sort": "desc", "limit": 5})
+def top_categories(query, plan, rollups, max_rows):
+    """Top products/categories"""
+    ranking = rank_label(plan)
+    result = make_result(rollups, plan, {"type": "pie", "title": f"{ranking} {plan['limit']} Product Categories by Revenue{describe_filters(plan)}"})
+    frame = result_frame(result, rollups)
+    if not len(frame):
+        return no_records(f"🏆 **{ranking} {plan['limit']} Product Categories{describe_filters(plan)}:**", result, plan)
+    top_categories = frame['Revenue']
+
+    return {
+        "role": "assistant",
+        "content": f"🏆 **{ranking} {plan['limit']} Product Categories{describe_filters(plan)}:**\n\n1. **{top_categories.index[0]}**: ${top_categories.iloc[0]:,.2f}{plus_minus(plan, frame, 'Revenue', top_categories.index[0])}",
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+@router.intent("customer_types", {
+    "customer": (['customer', 'new', 'returning'], 2.0),
+    "revenue": (REVENUE_WORDS, 0.5),
+}, required=["customer"], defaults={"measures": ["Revenue", "Units_Sold"], "agg": "sum", "dimensions": ["Customer_Type"]})
+def customer_types(query, plan, rollups, max_rows):
+    """Customer analysis"""
+    # Naming revenue alone still shows both measures for this analysis
+    plan = dict(plan, measures=["Revenue", "Units_Sold"])
+    result = make_result(rollups, plan, {"type": "bar", "title": f"Revenue by Customer Type{describe_filters(plan)}"})
+
+    return {
+        "role": "assistant",
+        "content": f"👥 **Customer Type Analysis{describe_filters(plan)}:**\n\nBreaking down performance by customer type...",
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+@router.intent("regions", {
+    "region": (['region', 'regional', 'location', 'geographic'], 2.0),
+    "revenue": (REVENUE_WORDS, 0.5),
+    "top": (TOP_WORDS, 0.5),
+}, required=["region"], defaults={"measures": ["Revenue"], "agg": "sum", "dimensions": ["Region"], "sort": "desc"})
+def regions(query, plan, rollups, max_rows):
+    """Regional analysis"""
+    result = make_result(rollups, plan, {"type": "bar", "title": f"Revenue by Region{describe_filters(plan)}"})
+    frame = result_frame(result, rollups)
+    if not len(frame):
+        return no_records(f"🌍 **Regional Performance{describe_filters(plan)}:**", result, plan)
+    regional_data = frame['Revenue']
+
+    return {
+        "role": "assistant",
+        "content": f"🌍 **Regional Performance{describe_filters(plan)}:**\n\n{rank_label(plan, 'Top', 'Lowest')} region: **{regional_data.index[0]}** with ${regional_data.iloc[0]:,.2f}{plus_minus(plan, frame, 'Revenue', regional_data.index[0])}",
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+@router.intent("summary", {
+    "summary": (['summary', 'overview', 'describe'], 2.0),
+}, required=["summary"])
+def summary(query, plan, rollups, max_rows):
+    """Summary/overview, built from the dataset's cached profile"""
+    profile = rollups.profile()
+    lines = []
+    if profile["time"]:
+        stats = profile["columns"][profile["time"]]
+        lines.append(f"• **Time Period:** {stats['min'].date()} to {stats['max'].date()}")
+    for measure in profile["measures"]:
+        agg = DEFAULT_AGG.get(measure, 'sum')
+        value = format_value({"measures": [measure], "agg": agg}, rollups.get(None, measure, agg=agg))
+        lines.append(f"• **{AGG_LABELS[agg]} {measure.replace('_', ' ')}:** {value}")
+    for dimension in profile["dimensions"]:
+        lines.append(f"• **{dimension.replace('_', ' ')}:** {profile['columns'][dimension]['distinct']:,} distinct")
+    lines.append(f"• **Records:** {profile['rows']:,}")
+
+    return {
+        "role": "assistant",
+        "content": "📊 **Dataset Overview:**\n\n" + "\n".join(lines),
+        "result": make_result(rollups, {"head": max_rows}),
+        "code": "df.describe()"
+    }
+
+
+AGG_LABELS = {'sum': 'Total', 'mean': 'Average', 'min': 'Minimum', 'max': 'Maximum',
+              'size': 'Number of records', 'count': 'Count of', 'nunique': 'Distinct', 'median': 'Median'}
+
+
+def planned_analysis(query, plan, rollups, max_rows):
+    """Any other question the planner understands, answered from its plan"""
+    keys = plan_keys(plan)
+    measure = plan["measures"][0]
+    if plan["agg"] == 'size':
+        title = AGG_LABELS['size']
+    else:
+        title = f"{AGG_LABELS[plan['agg']]} {measure.replace('_', ' ')}"
+    by = [
+        GRAIN_NAMES[plan["grain"]] if column == plan["time"] else column.replace('_', ' ')
+        for column in keys if column != PERIOD_KEY
+    ]
+    if by:
+        title += f" by {' and '.join(by)}"
+    if plan.get("periods"):
+        title += f", {' vs '.join(period_label(period) for period in plan['periods'])}"
+    title += describe_filters(plan)
+
+    chart = None
+    if keys:
+        chart = {"type": "line" if plan["time"] else "bar", "title": title}
+    result = make_result(rollups, plan, chart)
+    frame = result_frame(result, rollups)
+
+    if not len(frame):
+        content = f"📊 **{title}:** no records in this range."
+    elif not keys:
+        content = f"📊 **{title}:** {format_value(plan, frame[measure].iloc[0])}{plus_minus(plan, frame, measure, frame.index[0])}"
+    elif keys == [PERIOD_KEY]:
+        values = frame[measure]
+        lines = [f"• **{label}:** {format_value(plan, value)}" for label, value in values.items()]
+        if len(values) == 2 and values.iloc[1]:
+            lines.append(f"• **Change:** {(values.iloc[0] - values.iloc[1]) / abs(values.iloc[1]):+.1%}")
+        content = f"📊 **{title}:**\n\n" + "\n".join(lines)
+    else:
+        # Ascending questions ("bottom 3 ...") are answered with their lowest group
+        lowest = plan["sort"] == "asc"
+        best = frame[measure].idxmin() if lowest else frame[measure].idxmax()
+        margin = plus_minus(plan, frame, measure, best)
+        value = frame[measure].min() if lowest else frame[measure].max()
+        best = " / ".join(map(str, best)) if isinstance(best, tuple) else best
+        content = (
+            f"📊 **{title}:**\n\n• **{rank_label(plan, 'Highest', 'Lowest')}:** {best} ({format_value(plan, value)}{margin})"
+            f"\n• **Groups:** {len(frame):,}"
+        )
+    return {
+        "role": "assistant",
+        "content": content,
+        "result": result,
+        "code": plan_code(plan)
+    }
+
+
+def default_response(query):
+    return {
+        "role": "assistant",
+        "content": f"""🤔 I'd love to help analyze: "{query}"
+
+Here are some things you can ask me:
+
+**📈 Revenue & Sales:**
+• "Show me revenue trends over time"
+• "Which product category generates the most revenue?"
+
+**🏆 Performance:**
+• "What are the top performing regions?"
+• "Compare new vs returning customers"
+
+**📊 General:**
+• "Give me a summary of the data"
+• "Show me customer ratings analysis"
+
+What would you like to explore?"""
+    }
+
+
+def resolve_query(query, rollups):
+    """Pick the handler for a question and complete its plan
+
+    Returns (handler, intent name, confidence, plan) or None when nothing
+    matches. The plan is None for intents that do not answer from one.
+    """
+    plan = parse_plan(query, rollups)
+    profile = rollups.profile()
+    intent, confidence = router.route(query)
+    # Canned analyses only apply to datasets that have the columns they answer from
+    if intent is not None and defaults_available(intent["defaults"], profile) and is_compatible(plan, intent["defaults"]):
+        if intent["defaults"] is None:
+            return intent["handler"], intent["name"], confidence, None
+        return intent["handler"], intent["name"], confidence, complete_plan(plan, profile, intent["defaults"])
+    if plan["measures"] or plan["dimensions"] or plan["time"] or plan["filters"] or plan["periods"]:
+        # No canned analysis fits; answer straight from the plan
+        return planned_analysis, "planned_analysis", 1.0, complete_plan(plan, profile)
+    return None
+
+
+def _response_key(rollups, name, plan, max_rows):
+    # Differently worded questions with the same plan share one response
+    return (rollups.name, rollups.version, name, json.dumps(plan, sort_keys=True, default=str), max_rows)
+
+
+def question_cost(query, rollups, max_rows=20):
+    """Admission cost of a question: 1, plus its plan's cost (see planner.plan_cost) unless the answer is cached
+
+    Approximate answers cost the same: the exact answer is still computed.
+    Runs on the script thread, so it never scans: until the planner vocabulary
+    is built, a question is priced as a scan of the whole dataset.
+    """
+    if ("vocabulary",) not in rollups:
+        return 1.0 + rollups.backend.num_rows / COST_ROWS
+    resolved = resolve_query(query, rollups)
+    if resolved is None:
+        return 1.0
+    _, name, _, plan = resolved
+    if plan is None or _response_key(rollups, name, plan, max_rows) in responses:
+        return 1.0
+    return 1.0 + plan_cost(plan, rollups)
+
+
+def error_response(error):
+    return {
+        "role": "assistant",
+        "content": f"❌ I encountered an error: {str(error)}\n\nTry asking for a 'summary' or be more specific about what you'd like to analyze."
+    }
+
+
+# Appended to approximate answers; the second part while the exact one is computed
+APPROXIMATE_NOTE = "\n\n≈ *Estimated from a sample of {rows:,} rows; ± marks 95% confidence intervals.*"
+EXACT_PENDING = " *Computing the exact answer...*"
+
+
+def approximate_note(rollups):
+    return APPROXIMATE_NOTE.format(rows=len(sample_of(rollups).frame))
+
+
+def settle_estimate(response):
+    """An approximate answer streamed ahead of the exact one, as a final answer
+
+    Used when the exact answer never arrives (cancelled or timed out).
+    """
+    response = dict(response, content=response["content"].replace(EXACT_PENDING, ""))
+    response.pop("stage", None)
+    return response
+
+
+def process_query(query, df, max_rows=20, rollups=None, approximate=False):
+    """Process natural language query and return response with visualizations
+
+    `df` is a DataFrame or a dataset backend (see dataset_engine). Charts and
+    tables are returned as a result descriptor; build them with
+    result_figure/result_frame. With `approximate`, large aggregates are
+    estimated from the dataset's sample (see approximate).
+    """
+
+    # Aggregates come from the shared rollup cache, built once per dataset version
+    if rollups is None:
+        rollups = RollupCache(df)
+
+    try:
+        with metrics.stage("route"):
+            resolved = resolve_query(query, rollups)
+        if resolved is None:
+            return default_response(query)
+
+        handler, name, confidence, plan = resolved
+        estimated = approximate and approximates(plan, rollups)
+        if estimated:
+            plan = dict(plan, approximate=True)
+        with metrics.stage("compute", intent=name):
+            response = responses.get_or_build(
+                _response_key(rollups, name, plan, max_rows),
+                lambda: handler(query, plan, rollups, max_rows),
+                rollups.name, rollups.version,
+            )
+        if estimated:
+            response = dict(response, content=response["content"] + approximate_note(rollups))
+        return dict(response, intent={"name": name, "confidence": round(confidence, 2)})
+
+    except Exception as e:
+        return error_response(e)
+
+
+# Datasets at least this large are scanned in chunks with running totals
+STREAM_MIN_ROWS = 1_000_000
+
+
+def running_totals(plan, rows_done, rows_total, frame):
+    """Progress message shown while a large aggregate is being scanned"""
+    measure = plan["measures"][0]
+    progress = rows_done / rows_total if rows_total else 1.0
+    lines = [f"⏳ **Scanning...** {rows_done:,} of {rows_total:,} rows ({progress:.0%})"]
+    if plan["agg"] in ('sum', 'size', 'count'):
+        label = AGG_LABELS['size'] if plan["agg"] == 'size' else f"{AGG_LABELS[plan['agg']]} {measure.replace('_', ' ')}"
+        lines.append(f"• **{label} so far:** {format_value(plan, frame[measure].sum())}")
+    if plan_keys(plan) and len(frame):
+        leader = frame[measure].idxmax()
+        leader = " / ".join(map(str, leader)) if isinstance(leader, tuple) else leader
+        lines.append(f"• **Leading so far:** {leader} ({format_value(plan, frame[measure].max())})")
+    return "\n".join(lines)
+
+
+def stream_query(query, df, max_rows=20, rollups=None, approximate=False):
+    """Like process_query, but yields progressively more complete responses
+
+    Large aggregates are scanned in chunks, yielding running totals; then come
+    the headline text, the table and finally the full response with its
+    chart. Every response but the last carries a "stage" key. With
+    `approximate`, large aggregates are instead answered from the dataset's
+    sample first (stage "approximate", complete with table and chart) and
+    the exact answer replaces the estimate once it is computed.
+    """
+    if rollups is None:
+        rollups = RollupCache(df)
+
+    try:
+        with metrics.stage("route"):
+            resolved = resolve_query(query, rollups)
+        if resolved is None:
+            yield default_response(query)
+            return
+
+        handler, name, confidence, plan = resolved
+        key = _response_key(rollups, name, plan, max_rows)
+        estimated = approximate and key not in responses and approximates(plan, rollups)
+        if estimated:
+            estimate = dict(plan, approximate=True)
+            with metrics.stage("compute", intent=name):
+                response = responses.get_or_build(
+                    _response_key(rollups, name, estimate, max_rows),
+                    lambda: handler(query, estimate, rollups, max_rows),
+                    rollups.name, rollups.version,
+                )
+            result_figure(response["result"], rollups)
+            yield dict(response, content=response["content"] + approximate_note(rollups) + EXACT_PENDING,
+                       intent={"name": name, "confidence": round(confidence, 2)}, stage="approximate")
+        elif (key not in responses and plan is not None and plan["agg"] in MERGEABLE_AGGS and not plan["periods"]
+                and rollups.backend.num_rows >= STREAM_MIN_ROWS and ("plan", plan_key(plan)) not in rollups
+                and not uses_time_index(plan, rollups)):
+            started = time.perf_counter()
+            for rows_done, rows_total, frame in scan_plan(plan, rollups):
+                yield {"role": "assistant", "content": running_totals(plan, rows_done, rows_total, frame), "stage": "scanning"}
+            if metrics.enabled():
+                metrics.observe("scan", time.perf_counter() - started, intent=name)
+
+        with metrics.stage("compute", intent=name):
+            response = responses.get_or_build(
+                key, lambda: handler(query, plan, rollups, max_rows), rollups.name, rollups.version
+            )
+        response = dict(response, intent={"name": name, "confidence": round(confidence, 2)})
+        result = response.get("result")
+        if result is None:
+            yield response
+            return
+
+        if not estimated:
+            # The estimate stays on screen until the exact answer is complete
+            yield {"role": "assistant", "content": response["content"], "stage": "headline"}
+            result_frame(result, rollups)
+            yield dict(response, stage="table")
+        # Build the figure here so rendering the final response is cheap
+        result_figure(result, rollups)
+        yield response
+
+    except Exception as e:
+        yield error_response(e)
@@ -0,0 +1,344 @@
+"""Approximate answers for interactive speed on large datasets
+
+Each dataset version keeps one stratified random sample: rows are drawn
+per month of the time column (per value of the smallest dimension when
+there is none), at least MIN_STRATUM_ROWS from every stratum, and carry
+the weight of the rows they stand for. Sums, counts and means are
+estimated from the sample with 95% confidence intervals, medians from its
+weighted quantiles and distinct counts from HyperLogLog sketches. Appended
+rows are sampled at their stratum's rate and merged into the sketches, so
+both stay current without a rescan.
+"""
+import numpy as np
+import pandas as pd
+
+from dataset_engine import InMemoryBackend, RollupCache
+from planner import answered_without_scan, plan_keys
+
+# Datasets smaller than this are always answered exactly
+APPROXIMATE_MIN_ROWS = 1_000_000
+# Rows drawn into a dataset's sample, spread over strata by their size...
+SAMPLE_ROWS = 100_000
+# ...but at least this many from each stratum, so small ones get a variance estimate
+MIN_STRATUM_ROWS = 50
+# Dimensions with more values than this are not used as strata
+MAX_STRATA = 100
+# Two-sided 95% confidence intervals
+Z_95 = 1.96
+# HyperLogLog registers per sketch (2 ** precision): about 1.6% standard error
+HLL_PRECISION = 12
+APPROXIMATE_AGGS = ('sum', 'size', 'count', 'mean', 'median', 'nunique')
+# Result columns holding a measure's confidence interval half-width
+MARGIN_SUFFIX = ' ±'
+STRATUM = '__stratum'
+
+
+def strata_column(profile):
+    """(column, grain) rows are stratified by, or None for a simple random sample"""
+    if profile["time"]:
+        return profile["time"], 'M'
+    dimensions = [d for d in profile["dimensions"] if profile["columns"][d]["distinct"] <= MAX_STRATA]
+    if dimensions:
+        return min(dimensions, key=lambda d: profile["columns"][d]["distinct"]), None
+    return None
+
+
+def stratum_labels(chunk, strata):
+    """Stratum of every row of a chunk, as strings ("" for missing values)"""
+    if strata is None:
+        return pd.Series('All', index=chunk.index)
+    column, grain = strata
+    values = chunk[column].dt.to_period(grain) if grain else chunk[column]
+    # Categories are converted to strings once, not every row
+    labels = values.astype('category')
+    labels = labels.cat.rename_categories(labels.cat.categories.astype(str))
+    return labels.cat.add_categories([""] if "" not in labels.cat.categories else []).fillna("")
+
+
+class StratifiedSample:
+    """Stratified random sample of one dataset version
+
+    `frame` holds the sampled rows and their stratum; `population` and
+    `sampled` count the dataset's and the sample's rows per stratum, and
+    `rates` are the probabilities rows were drawn with.
+    """
+
+    def __init__(self, frame, population, rates, strata):
+        self.frame = frame.assign(**{STRATUM: frame[STRATUM].astype('category')})
+        self.population = population
+        self.rates = rates
+        self.strata = strata
+        self.sampled = frame[STRATUM].value_counts().reindex(population.index, fill_value=0)
+
+    @property
+    def weights(self):
+        """Rows each sampled row stands for"""
+        return self.frame[STRATUM].map(self.population / self.sampled).astype(float)
+
+    def extended(self, batch, rng=None):
+        """This sample plus the rows of `batch` drawn at their stratum's rate
+
+        Strata first seen in the batch are drawn at the overall rate.
+        """
+        labels = stratum_labels(batch, self.strata)
+        # Categories the batch has no rows for are not new strata
+        counts = labels.value_counts()
+        population = self.population.add(counts[counts > 0], fill_value=0).astype('int64')
+        default = min(1.0, SAMPLE_ROWS / population.sum())
+        rates = self.rates.reindex(population.index, fill_value=default)
+        drawn = draw(batch, labels, rates, rng or np.random.default_rng())
+        return StratifiedSample(pd.concat([self.frame, drawn], ignore_index=True), population, rates, self.strata)
+
+
+def draw(chunk, labels, rates, rng):
+    """Rows of a chunk kept with their stratum's probability"""
+    keep = rng.random(len(chunk)) < labels.map(rates).to_numpy(dtype=float)
+    return chunk[keep].assign(**{STRATUM: labels[keep]})
+
+
+def build_sample(rollups, seed=0):
+    """Draw a dataset's stratified sample in one pass over its rows"""
+    strata = strata_column(rollups.profile())
+    rows = rollups.backend.num_rows
+    if strata is None:
+        population = pd.Series({'All': rows})
+    else:
+        column, grain = strata
+        sizes = rollups.get(column, column, grain, 'size')
+        population = pd.Series(sizes.to_numpy(), index=sizes.index.astype(str))
+        if population.sum() < rows:
+            population[""] = rows - population.sum()
+    population = population.astype('int64')
+    target = np.maximum(SAMPLE_ROWS * population / max(rows, 1), MIN_STRATUM_ROWS)
+    rates = (target / population).clip(upper=1.0)
+
+    rng = np.random.default_rng(seed)
+    columns = list(rollups.backend.dtypes)
+    parts = [draw(chunk, stratum_labels(chunk, strata), rates, rng) for chunk in rollups.backend.iter_chunks(columns)]
+    frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns + [STRATUM])
+    return StratifiedSample(frame, population, rates, strata)
+
+
+def sample_of(rollups):
+    """The stratified sample of a dataset version, drawn on first use"""
+    return rollups.cached(("sample",), lambda: build_sample(rollups))
+
+
+def extend_sample(key, sample, batch):
+    return sample.extended(batch.df)
+
+
+RollupCache.updaters["sample"] = extend_sample
+
+
+def hll_registers(values, precision=HLL_PRECISION):
+    """Register index and rank (position of the first 1 bit) of each value's 64-bit hash"""
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    # The next 53 bits convert to float exactly; frexp gives their bit length
+    rest = ((hashes << np.uint64(precision)) >> np.uint64(11)).astype(np.float64)
+    rank = 54 - np.frexp(rest)[1]
+    return index, rank.astype(np.uint8)
+
+
+def hll_sketches(chunk, key, measure, grain=None):
+    """{group: HyperLogLog registers} of `measure`'s values in a chunk, grouped by `key`"""
+    chunk = chunk[chunk[measure].notna()]
+    if key is None:
+        codes, groups = np.zeros(len(chunk), dtype=np.int64), ['All']
+    else:
+        codes, groups = pd.factorize(chunk[key].dt.to_period(grain) if grain else chunk[key])
+    index, rank = hll_registers(chunk[measure])
+    registers = np.zeros((len(groups), 2 ** HLL_PRECISION), dtype=np.uint8)
+    np.maximum.at(registers, (codes, index), rank)
+    return dict(zip(groups, registers))
+
+
+def merge_sketches(sketches, other):
+    merged = dict(sketches)
+    for group, registers in other.items():
+        merged[group] = registers if group not in merged else np.maximum(merged[group], registers)
+    return merged
+
+
+def hll_estimate(registers):
+    """Distinct values counted by one sketch and the half-width of its 95% interval"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(float)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        # Small cardinalities: linear counting of the empty registers
+        estimate = m * np.log(m / zeros)
+    return estimate, Z_95 * 1.04 / np.sqrt(m) * estimate
+
+
+def sketches_of(rollups, key, measure, grain=None):
+    """HyperLogLog sketches of a measure per group of `key`, built in one pass"""
+    def build():
+        sketches = {}
+        columns = list(dict.fromkeys([column for column in (key, measure) if column is not None]))
+        for chunk in rollups.backend.iter_chunks(columns):
+            sketches = merge_sketches(sketches, hll_sketches(chunk, key, measure, grain))
+        return sketches
+    # Nested so the key is not mistaken for a 4-part rollup key
+    return rollups.cached(("hll", (key, measure, grain)), build)
+
+
+def extend_sketches(key, sketches, batch):
+    column, measure, grain = key[1]
+    return merge_sketches(sketches, hll_sketches(batch.df, column, measure, grain))
+
+
+RollupCache.updaters["hll"] = extend_sketches
+
+
+def approximates(plan, rollups):
+    """Whether a plan is worth answering approximately
+
+    Only large datasets are, and only while no exact answer is at hand: an
+    exact result already cached or a date range the time index answers
+    stays exact. Distinct counts need an unfiltered plan with at most one
+    group-by column, the sketches being kept per column.
+    """
+    if plan is None or plan.get("periods") or plan["agg"] not in APPROXIMATE_AGGS:
+        return False
+    if rollups.backend.num_rows < APPROXIMATE_MIN_ROWS:
+        return False
+    if plan["agg"] == 'nunique' and (plan["filters"] or len(plan_keys(plan)) > 1):
+        return False
+    return not answered_without_scan(plan, rollups)
+
+
+def _group_keys(data, plan):
+    keys = [data[column] for column in plan["dimensions"]]
+    if plan["time"]:
+        keys.insert(0, data[plan["time"]].dt.to_period(plan["grain"]))
+    if not keys:
+        keys = [pd.Series('All', index=data.index, name='Total')]
+    return keys
+
+
+def _stratum_variance(sums, squares, sampled, population):
+    """Variance of an estimated total, from per-stratum sums and sums of squares
+
+    Rows outside a group count as zeros; the finite population correction
+    makes fully sampled strata contribute nothing.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (squares - sums ** 2 / sampled) / (sampled - 1)
+        contribution = population ** 2 * (1 - sampled / population) * variance / sampled
+    return np.where(sampled > 1, contribution, 0.0)
+
+
+def _totals(data, plan, values, sample):
+    """Estimated totals of `values` per group with their variances"""
+    levels = list(range(len(_group_keys(data, plan))))
+    frame = pd.DataFrame({"sum": values, "square": values ** 2}, index=data.index)
+    grouped = frame.groupby(_group_keys(data, plan) + [data[STRATUM]], observed=True).sum()
+    stratum = grouped.index.get_level_values(-1)
+    sampled = sample.sampled.reindex(stratum).to_numpy(dtype=float)
+    population = sample.population.reindex(stratum).to_numpy(dtype=float)
+    totals = (grouped["sum"] * population / sampled).groupby(level=levels, observed=True).sum()
+    variances = pd.Series(
+        _stratum_variance(grouped["sum"].to_numpy(), grouped["square"].to_numpy(), sampled, population),
+        index=grouped.index,
+    ).groupby(level=levels, observed=True).sum()
+    return totals, variances, grouped.index
+
+
+def _estimate_total(data, plan, measure, sample):
+    if plan["agg"] == 'size':
+        values = pd.Series(1.0, index=data.index)
+    elif plan["agg"] == 'count':
+        values = data[measure].notna().astype(float)
+    else:
+        values = data[measure].astype(float).fillna(0.0)
+    totals, variances, _ = _totals(data, plan, values, sample)
+    return totals, Z_95 * np.sqrt(variances)
+
+
+def _estimate_mean(data, plan, measure, sample):
+    # Ratio of two estimated totals; its variance is that of the total of the
+    # residuals x - mean (Taylor linearization) over the squared count
+    present = data[measure].notna()
+    values = data[measure].astype(float).fillna(0.0)
+    sums, _, _ = _totals(data, plan, values, sample)
+    counts, _, _ = _totals(data, plan, present.astype(float), sample)
+    means = sums / counts
+    # Groups are numbered in the sorted order the estimates come in
+    groups = data.groupby(_group_keys(data, plan), observed=True).ngroup().to_numpy()
+    residuals = (values - means.to_numpy()[groups]).where(present, 0.0)
+    _, variances, _ = _totals(data, plan, residuals, sample)
+    return means, Z_95 * np.sqrt(variances) / counts
+
+
+def weighted_quantile(values, weights, q):
+    order = np.argsort(values)
+    values, weights = values[order], weights[order]
+    cumulative = np.cumsum(weights)
+    return values[min(np.searchsorted(cumulative, q * cumulative[-1]), len(values) - 1)]
+
+
+def _median(values, weights):
+    """Weighted sample median and the half-width of its Woodruff interval"""
+    keep = ~np.isnan(values)
+    values, weights = values[keep], weights[keep]
+    if not len(values):
+        return np.nan, np.nan
+    # Effective sample size of the weighted rows
+    rows = weights.sum() ** 2 / (weights ** 2).sum()
+    spread = Z_95 * np.sqrt(0.25 / rows)
+    low, high = (weighted_quantile(values, weights, q) for q in (max(0.5 - spread, 0), min(0.5 + spread, 1)))
+    return weighted_quantile(values, weights, 0.5), (high - low) / 2
+
+
+def _estimate_median(data, plan, measure, sample):
+    weights = sample.weights.loc[data.index].to_numpy()
+    values = data[measure].astype(float).to_numpy()
+    keys = _group_keys(data, plan)
+    groups = data.groupby(keys, observed=True).indices
+    index = pd.MultiIndex.from_tuples(list(groups)) if len(keys) > 1 else pd.Index(list(groups))
+    frame = pd.DataFrame([_median(values[rows], weights[rows]) for rows in groups.values()],
+                         index=index, columns=["value", "margin"], dtype=float)
+    return frame["value"].sort_index(), frame["margin"].sort_index()
+
+
+def _estimate_distinct(rollups, plan, measure):
+    keys = plan_keys(plan)
+    sketches = sketches_of(rollups, keys[0] if keys else None, measure, plan["grain"] if plan["time"] else None)
+    estimates = {group: hll_estimate(registers) for group, registers in sketches.items()}
+    frame = pd.DataFrame.from_dict(estimates, orient='index', columns=["value", "margin"]).sort_index()
+    return frame["value"].round(), frame["margin"]
+
+
+def estimate_plan(plan, rollups):
+    """Approximate result frame for a plan that approximates() accepts
+
+    Shaped like run_plan's, with a "<measure> ±" column of 95% confidence
+    interval half-widths next to every measure.
+    """
+    sample = sample_of(rollups)
+    data = sample.frame
+    if plan["filters"]:
+        data = data[InMemoryBackend(data)._mask(plan["filters"]).to_numpy()]
+
+    columns = {}
+    for measure in plan["measures"]:
+        if plan["agg"] == 'nunique':
+            value, margin = _estimate_distinct(rollups, plan, measure)
+        elif plan["agg"] == 'mean':
+            value, margin = _estimate_mean(data, plan, measure, sample)
+        elif plan["agg"] == 'median':
+            value, margin = _estimate_median(data, plan, measure, sample)
+        else:
+            value, margin = _estimate_total(data, plan, measure, sample)
+        columns[measure], columns[measure + MARGIN_SUFFIX] = value, margin
+    frame = pd.DataFrame(columns)
+
+    frame.index = frame.index.set_names(plan_keys(plan) or ['Total'])
+    if plan["sort"]:
+        frame = frame.sort_values(plan["measures"][0], ascending=plan["sort"] == "asc")
+    if plan["limit"]:
+        frame = frame.head(plan["limit"])
+    return frame
@@ -0,0 +1,255 @@
+"""Headless benchmarks for the question answering and transcript rendering paths
+
+Generates sample datasets of increasing size, replays a corpus of chat
+questions through process_query and reports latency percentiles, peak memory
+and allocations per intent. The transcript render loop is timed with
+Streamlit's AppTest, so no browser is needed. Results are written as JSON;
+pass an earlier result file as --baseline to compare against it.
+
+    $ python benchmark.py --rows 1000 100000 10000000 --output bench.json
+    $ python benchmark.py --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import parallel
+from analytics import built_results, process_query, resolve_query, responses, result_figure, result_frame
+from dataset_engine import DatasetRegistry, RollupCache, create_sample_dataset
+
+# Questions users ask, covering every canned intent and the planner
+QUESTIONS = [
+    "Show me revenue trends over time",
+    "What's the weekly revenue trend?",
+    "Which product categories perform best?",
+    "Revenue by product category",
+    "Top 5 categories by revenue",
+    "Compare new vs returning customers",
+    "Customer type analysis",
+    "How do different regions perform?",
+    "Regional sales breakdown",
+    "Give me a summary of the data",
+    "Average rating by region",
+    "Units sold by category in the North",
+    "Monthly units sold for Electronics",
+    "Total revenue by region and customer type",
+    "Maximum revenue by category",
+    "Number of orders by region",
+    "Quarterly revenue in the East",
+    "Hello",
+]
+
+ROW_COUNTS = [1_000, 100_000, 10_000_000]
+HISTORY_SIZES = [10, 100, 1000]
+PERCENTILES = (50, 95, 99)
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds"""
+    samples = np.asarray(samples) * 1000
+    summary = {f"p{p}_ms": round(float(np.percentile(samples, p)), 3) for p in PERCENTILES}
+    summary["mean_ms"] = round(float(samples.mean()), 3)
+    summary["runs"] = len(samples)
+    return summary
+
+
+def answer(question, backend, rollups, max_rows=10):
+    """Answer a question the way the app does, including its table and chart"""
+    response = process_query(question, backend, max_rows, rollups)
+    result = response.get("result")
+    if result is not None:
+        result_frame(result, rollups)
+        result_figure(result, rollups)
+    return response
+
+
+def traced(fn):
+    """Run `fn` under tracemalloc: (result, peak bytes, live blocks/bytes it allocated)"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics("filename")
+    finally:
+        tracemalloc.stop()
+    memory = {
+        "peak_bytes": peak,
+        "allocated_blocks": sum(stat.count for stat in stats),
+        "allocated_bytes": sum(stat.size for stat in stats),
+    }
+    return result, memory
+
+
+def clear_caches():
+    responses.invalidate()
+    built_results.invalidate()
+
+
+def bench_dataset(rows, repeat, questions=QUESTIONS):
+    """Replay the question corpus on a dataset with `rows` rows
+
+    Each question is timed cold (fresh rollups and result caches, as after a
+    dataset reload) and warm (answered again from the caches).
+    """
+    name = f"bench-{rows}"
+    registry = DatasetRegistry()
+    registry.register(name, lambda: create_sample_dataset(rows))
+    start = time.perf_counter()
+    (backend, rollups), build_memory = traced(lambda: (registry.backend(name), registry.rollups(name)))
+    build_seconds = time.perf_counter() - start
+
+    samples = {}
+    for question in questions:
+        resolved = resolve_query(question, rollups)
+        intent = resolved[1] if resolved else "default_response"
+        stats = samples.setdefault(intent, {"questions": [], "cold": [], "warm": [], "memory": [], "errors": 0})
+        stats["questions"].append(question)
+
+        for _ in range(repeat):
+            clear_caches()
+            rollups = RollupCache(backend, registry.version(name), name)
+            start = time.perf_counter()
+            response = answer(question, backend, rollups)
+            stats["cold"].append(time.perf_counter() - start)
+            stats["errors"] += response["content"].startswith("❌")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            answer(question, backend, rollups)
+            stats["warm"].append(time.perf_counter() - start)
+
+        clear_caches()
+        rollups = RollupCache(backend, registry.version(name), name)
+        _, memory = traced(lambda: answer(question, backend, rollups))
+        stats["memory"].append(memory)
+    clear_caches()
+
+    intents = {}
+    for intent, stats in samples.items():
+        intents[intent] = {
+            "questions": stats["questions"],
+            "cold": percentiles(stats["cold"]),
+            "warm": percentiles(stats["warm"]),
+            "peak_bytes": max(memory["peak_bytes"] for memory in stats["memory"]),
+            "allocated_blocks": max(memory["allocated_blocks"] for memory in stats["memory"]),
+            "allocated_bytes": max(memory["allocated_bytes"] for memory in stats["memory"]),
+            "errors": stats["errors"],
+        }
+    memory = registry.memory_report(name)
+    return {
+        "rows": rows,
+        "build_seconds": round(build_seconds, 3),
+        "build_peak_bytes": build_memory["peak_bytes"],
+        "dataset_bytes": memory["memory_after"] if memory else None,
+        "intents": intents,
+    }
+
+
+def bench_render(history_sizes, repeat, questions=QUESTIONS):
+    """Time script runs of the chat page with transcripts of increasing length"""
+    from streamlit.testing.v1 import AppTest
+
+    # Same dataset and version the app's own registry serves
+    registry = DatasetRegistry()
+    registry.register("sample", create_sample_dataset)
+    backend, rollups = registry.backend("sample"), registry.rollups("sample")
+    turns = []
+    for question in questions:
+        turns.append({"role": "user", "content": question})
+        turns.append(process_query(question, backend, 10, rollups))
+
+    os.environ.setdefault("COGNICHAT_HISTORY_DB", ":memory:")
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+    results = []
+    for size in history_sizes:
+        at = AppTest.from_file(app, default_timeout=120)
+        at.session_state["authenticated"] = True
+        at.session_state["user_info"] = {"username": "benchmark"}
+        at.session_state["messages"] = [dict(turns[i % len(turns)]) for i in range(size)]
+        # Render the transcript above as is, not the benchmark user's stored history
+        at.session_state["history_loaded"] = True
+        # First run loads the dataset and builds the charts
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            at.run()
+            runs.append(time.perf_counter() - start)
+        results.append({"messages": size, "rerun": percentiles(runs), "elements": len(at.main.children)})
+    return results
+
+
+def compare(report, baseline):
+    """Print p95 latency changes against an earlier report"""
+    previous = {item["rows"]: item for item in baseline.get("datasets", [])}
+    for item in report["datasets"]:
+        old = previous.get(item["rows"])
+        if old is None:
+            continue
+        for intent, stats in item["intents"].items():
+            if intent not in old["intents"]:
+                continue
+            for mode in ("cold", "warm"):
+                before, after = old["intents"][intent][mode]["p95_ms"], stats[mode]["p95_ms"]
+                change = (after - before) / before if before else 0.0
+                flag = "  <-- slower" if change > 0.2 else ""
+                print(f"{item['rows']:>10,} {intent:<18} {mode:<4} p95 {before:9.2f} -> {after:9.2f} ms ({change:+.0%}){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=ROW_COUNTS, help="dataset sizes to generate")
+    parser.add_argument("--history", type=int, nargs="*", default=HISTORY_SIZES,
+                        help="transcript lengths for the render benchmark (none to skip it)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per question and mode")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the JSON report")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "workers": parallel.worker_count(),
+        },
+        "repeat": args.repeat,
+        "datasets": [],
+        "render": [],
+    }
+    for rows in args.rows:
+        print(f"Benchmarking {rows:,} rows...")
+        report["datasets"].append(bench_dataset(rows, args.repeat))
+        for intent, stats in report["datasets"][-1]["intents"].items():
+            print(f"  {intent:<18} cold p50 {stats['cold']['p50_ms']:9.2f} ms  p99 {stats['cold']['p99_ms']:9.2f} ms"
+                  f"  warm p50 {stats['warm']['p50_ms']:7.3f} ms  peak {stats['peak_bytes'] / 1024 ** 2:8.1f} MB")
+    if args.history:
+        print("Benchmarking transcript rendering...")
+        report["render"] = bench_render(args.history, args.repeat)
+        for item in report["render"]:
+            print(f"  {item['messages']:>5} messages  rerun p50 {item['rerun']['p50_ms']:8.1f} ms"
+                  f"  p99 {item['rerun']['p99_ms']:8.1f} ms")
+        # Recorded by the app while the render benchmark started it up
+        report["startup"] = metrics.startup()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
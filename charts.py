@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from planner import plan_keys
+
+# Chart payload budget: at most this many points are sent to the browser per
+# figure (roughly 32 bytes each once serialized)
+MAX_CHART_POINTS = 4000
+# Categorical charts keep this many categories and fold the rest into "Other"
+MAX_CATEGORIES = {"bar": 25, "pie": 10}
+# Line charts keep this many colour series and fold the rest into "Other",
+# so every series keeps enough points once the budget is shared out
+MAX_SERIES = 20
+OTHER_LABEL = "Other"
+# Line charts with more points than this are drawn with WebGL
+WEBGL_MIN_POINTS = 1000
+# Aggregations for which the "Other" bucket can be computed by summing
+ADDITIVE_AGGS = ('sum', 'size', 'count')
+
+
+def lttb(y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of `n_out` points keeping the shape of `y`
+
+    Points are assumed evenly spaced, which holds for time buckets.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # n_out - 2 buckets between the first and last points, which are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    anchor = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = (end, edges[bucket + 2]) if bucket + 2 < len(edges) else (n - 1, n)
+        next_x, next_y = (next_start + next_end - 1) / 2, y[next_start:next_end].mean()
+        x = np.arange(start, end)
+        area = np.abs((anchor - next_x) * (y[start:end] - y[anchor]) - (anchor - x) * (next_y - y[anchor]))
+        anchor = start + int(area.argmax())
+        selected[bucket + 1] = anchor
+    return selected
+
+
+def min_max(y, n_out):
+    """Indices of the minimum and maximum of `y` in each of `n_out // 2` buckets"""
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(int)
+    selected = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            selected += [start + int(y[start:end].argmin()), start + int(y[start:end].argmax())]
+    return np.unique(selected)
+
+
+def downsample(y, n_out):
+    """Indices of at most `n_out` points of a series
+
+    Very long series are first cut down with min-max buckets (linear and
+    cheap, keeps spikes), then LTTB picks the final points.
+    """
+    if len(y) > 4 * n_out:
+        coarse = min_max(y, 4 * n_out)
+        return coarse[lttb(np.asarray(y)[coarse], n_out)]
+    return lttb(y, n_out)
+
+
+def fold_categories(data, dimension, measure, color, limit, agg):
+    """Keep the `limit - 1` largest categories and fold the rest into "Other"
+
+    The rest are summed for additive aggregations and dropped otherwise.
+    """
+    totals = data.groupby(dimension, observed=True)[measure].sum().sort_values(ascending=False)
+    keep = set(totals.index[:limit - 1])
+    kept = data[data[dimension].isin(keep)]
+    if agg not in ADDITIVE_AGGS:
+        return kept
+    rest = data[~data[dimension].isin(keep)]
+    keys = [color] if color else []
+    if keys:
+        other = rest.groupby(keys, observed=True)[measure].sum().reset_index()
+    else:
+        other = pd.DataFrame({measure: [rest[measure].sum()]})
+    other[dimension] = OTHER_LABEL
+    kept = kept.astype({dimension: str})
+    # Columns other than the measure (e.g. confidence intervals) are left empty for "Other"
+    return pd.concat([kept, other.reindex(columns=kept.columns)], ignore_index=True)
+
+
+def prepare_chart_data(data, chart, query):
+    """Fit a chart's data to the payload budget before it is plotted
+
+    Returns the data to plot, a note for the title ("" when nothing was cut)
+    and whether to draw with WebGL.
+    """
+    keys, measure = plan_keys(query), query["measures"][0]
+    dimension = keys[0]
+    color = keys[1] if len(keys) > 1 else None
+    points = len(data)
+
+    if chart["type"] == "line" or query["time"]:
+        note = ""
+        series_count = data[color].nunique() if color else 1
+        if series_count > MAX_SERIES:
+            data = fold_categories(data, color, measure, dimension, MAX_SERIES + 1, query["agg"])
+            other = f" + {OTHER_LABEL}" if query["agg"] in ADDITIVE_AGGS else ""
+            note = f" (top {MAX_SERIES} of {series_count:,} series{other})"
+        if len(data) > MAX_CHART_POINTS:
+            series = [group for _, group in data.groupby(color, observed=True, sort=False)] if color else [data]
+            per_series = max(MAX_CHART_POINTS // len(series), 3)
+            data = pd.concat([group.iloc[downsample(group[measure].to_numpy(), per_series)] for group in series])
+            note += f" (showing {len(data):,} of {points:,} points)"
+        return data, note, len(data) > WEBGL_MIN_POINTS
+
+    limit = MAX_CATEGORIES["pie" if chart["type"] == "pie" else "bar"]
+    categories = data[dimension].nunique()
+    if categories > limit:
+        data = fold_categories(data, dimension, measure, color, limit, query["agg"])
+        if query["agg"] in ADDITIVE_AGGS:
+            return data, f" (top {limit - 1} of {categories:,} + {OTHER_LABEL})", False
+        return data, f" (top {limit - 1} of {categories:,})", False
+    return data, "", False
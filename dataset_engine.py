@@ -0,0 +1,831 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("cognichat.datasets")
+
+# Copy-on-write makes shallow copies behave as private, read-only views of the
+# shared frame: a session that modifies its view gets its own copy and the
+# shared data is never touched. It is always on from pandas 3.0.
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+def create_sample_dataset(rows=1000, seed=42):
+    """Create a sample dataset - replace this with your actual data loading logic
+
+    `rows` and `seed` let benchmarks generate larger datasets with the same schema.
+    """
+    # Sample e-commerce data
+    np.random.seed(seed)
+    dates = pd.date_range('2024-01-01', '2024-12-31', freq='D')
+
+    data = {
+        'Date': np.random.choice(dates, rows),
+        'Product_Category': np.random.choice(['Electronics', 'Clothing', 'Books', 'Home', 'Sports'], rows),
+        'Revenue': np.random.normal(1000, 300, rows).round(2),
+        'Units_Sold': np.random.poisson(5, rows),
+        'Customer_Type': np.random.choice(['New', 'Returning'], rows, p=[0.3, 0.7]),
+        'Region': np.random.choice(['North', 'South', 'East', 'West'], rows),
+        'Rating': np.random.choice([1, 2, 3, 4, 5], rows, p=[0.05, 0.1, 0.2, 0.35, 0.3])
+    }
+
+    df = pd.DataFrame(data)
+    df['Revenue'] = df['Revenue'].abs()  # Ensure positive revenue
+    return df.sort_values('Date').reset_index(drop=True)
+
+
+# Text columns whose names contain one of these are parsed as dates on load
+DATE_NAME_HINTS = ('date', 'time', 'day', 'timestamp')
+DATASET_EXTENSIONS = ('.csv', '.parquet', '.arrow', '.feather')
+
+
+def time_column(df):
+    """First datetime column of a frame, or None; rows are kept sorted on it"""
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            return col
+    return None
+
+
+def load_dataset_file(path):
+    """Load a dataset from a CSV or Parquet file on local disk"""
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    for col in df.columns:
+        if pd.api.types.is_string_dtype(df[col].dtype) and any(hint in col.lower() for hint in DATE_NAME_HINTS):
+            try:
+                df[col] = pd.to_datetime(df[col])
+            except (ValueError, TypeError):
+                pass
+    column = time_column(df)
+    if column is not None:
+        df = df.sort_values(column).reset_index(drop=True)
+    return df
+
+
+def normalize_dataset(df, max_category_ratio=0.5):
+    """Compact a freshly loaded frame into a columnar-friendly layout
+
+    Low-cardinality string columns become categoricals, integer columns are
+    downcast to the smallest type that holds them and rows are pre-sorted on
+    the time column. Floats are left at full precision so revenue totals stay exact.
+    Returns the normalized frame and a memory report in bytes.
+    """
+    memory_before = int(df.memory_usage(deep=True).sum())
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_string_dtype(series.dtype) and not isinstance(series.dtype, pd.CategoricalDtype):
+            if series.nunique() <= max(1, len(series) * max_category_ratio):
+                series = series.astype('category')
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            series = pd.to_numeric(series, downcast='integer')
+        columns[col] = series
+    df = pd.DataFrame(columns)
+    column = time_column(df)
+    if column is not None and not df[column].is_monotonic_increasing:
+        df = df.sort_values(column, kind='stable')
+    df = df.reset_index(drop=True)
+    report = {
+        "memory_before": memory_before,
+        "memory_after": int(df.memory_usage(deep=True).sum()),
+    }
+    return df, report
+
+
+def append_rows(df, batch):
+    """Append the rows of `batch` to a normalized frame
+
+    The batch is coerced to the frame's layout (categories are extended,
+    integers kept at their downcast type when they fit) and rows stay sorted
+    on the time column. Returns the combined frame and the coerced batch.
+    """
+    missing = [col for col in df.columns if col not in batch.columns]
+    if missing:
+        raise ValueError(f"Batch is missing columns: {', '.join(missing)}")
+    columns, rows = {}, {}
+    for col in df.columns:
+        series, new = df[col], batch[col].reset_index(drop=True)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # New values are added after the existing categories so old codes stay valid
+            added = pd.Index(new.dropna().unique()).difference(series.cat.categories)
+            if len(added):
+                series = series.cat.add_categories(added)
+            new = new.astype(series.dtype)
+        elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+            new = pd.to_datetime(new)
+        elif pd.api.types.is_integer_dtype(series.dtype) and pd.api.types.is_integer_dtype(new.dtype):
+            limits = np.iinfo(series.dtype)
+            if len(new) and limits.min <= new.min() and new.max() <= limits.max:
+                new = new.astype(series.dtype)
+        rows[col] = new
+        columns[col] = pd.concat([series, new], ignore_index=True)
+    frame = pd.DataFrame(columns)
+    column = time_column(frame)
+    if column is not None and not frame[column].is_monotonic_increasing:
+        frame = frame.sort_values(column, kind='stable').reset_index(drop=True)
+    return frame, pd.DataFrame(rows)
+
+
+# How the aggregates of two disjoint sets of rows combine
+DELTA_AGGS = {'sum': 'sum', 'size': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def merge_delta(value, delta, agg):
+    """Combine an aggregate with the same aggregate over newly appended rows"""
+    how = DELTA_AGGS[agg]
+    if not isinstance(value, pd.Series):
+        values = [v for v in (value, delta) if not pd.isna(v)]
+        if not values:
+            return value
+        if how == 'sum':
+            return sum(values)
+        return min(values) if how == 'min' else max(values)
+    combined = pd.concat([value, delta])
+    return combined.groupby(level=list(range(combined.index.nlevels)), observed=True).agg(how)
+
+
+def column_role(dtype):
+    """How questions use a column: 'measure' (aggregated), 'time' (bucketed) or 'dimension' (grouped by)"""
+    dtype = dtype.lower()
+    if 'datetime' in dtype:
+        return 'time'
+    if dtype.startswith(('int', 'uint', 'float')):
+        return 'measure'
+    return 'dimension'
+
+
+def build_profile(rollups):
+    """Schema, row count and per-column statistics of one dataset version
+
+    Built from scalar rollups, so after an append most of it is updated by
+    delta rather than rescanned. Distinct counts are only taken for
+    dimensions; they are what the planner and the sidebar need.
+    """
+    rows = rollups.backend.num_rows
+    profile = {"rows": rows, "columns": {}, "time": None, "measures": [], "dimensions": []}
+    for column, dtype in rollups.backend.dtypes.items():
+        role = column_role(dtype)
+        stats = {"dtype": dtype, "role": role, "nulls": int(rows - rollups.get(None, column, agg='count'))}
+        if role == 'dimension':
+            stats["distinct"] = int(rollups.get(None, column, agg='nunique'))
+            profile["dimensions"].append(column)
+        else:
+            stats["min"] = rollups.get(None, column, agg='min')
+            stats["max"] = rollups.get(None, column, agg='max')
+            if role == 'measure':
+                profile["measures"].append(column)
+            elif profile["time"] is None:
+                profile["time"] = column
+        profile["columns"][column] = stats
+    return profile
+
+
+class InMemoryBackend:
+    """Serves queries from a pandas DataFrame held in memory"""
+
+    def __init__(self, df):
+        self.df = df
+        self._orders = OrderedDict()
+
+    @property
+    def num_rows(self):
+        return len(self.df)
+
+    @property
+    def dtypes(self):
+        return {col: str(dtype) for col, dtype in self.df.dtypes.items()}
+
+    def memory_usage(self):
+        return int(self.df.memory_usage(deep=True).sum())
+
+    def head(self, n):
+        return self.df.head(n)
+
+    def to_pandas(self):
+        return self.df
+
+    def aggregate(self, dimension, measure, grain=None, agg='sum'):
+        df = self.df
+        if dimension is None:
+            return df[measure].agg(agg)
+        keys = df[dimension].dt.to_period(grain) if grain else df[dimension]
+        return df.groupby(keys, observed=True)[measure].agg(agg)
+
+    def count_rows(self, filters=None):
+        if not filters:
+            return len(self.df)
+        return int(self._mask(filters).sum())
+
+    def iter_chunks(self, columns, filters=None, chunk_rows=250_000):
+        """Yield the rows matching `filters` as DataFrames of at most `chunk_rows` rows"""
+        for start in range(0, len(self.df), chunk_rows):
+            chunk = self.df.iloc[start:start + chunk_rows]
+            if filters:
+                chunk = chunk[InMemoryBackend(chunk)._mask(filters)]
+            yield chunk[columns]
+
+    def page(self, filters=None, sort=None, descending=False, offset=0, limit=20):
+        """Rows `offset` to `offset + limit` of the filtered, sorted table and the filtered row count"""
+        positions = self._order(filters, sort, descending)
+        if positions is None:
+            return self.df.iloc[offset:offset + limit], len(self.df)
+        return self.df.iloc[positions[offset:offset + limit]], len(positions)
+
+    def _order(self, filters, sort, descending):
+        # Row positions of the filtered, sorted table; the last few are reused for paging
+        if not filters and not sort:
+            return None
+        key = json.dumps([filters, sort, descending], sort_keys=True, default=str)
+        positions = self._orders.get(key)
+        if positions is None:
+            mask = self._mask(filters)
+            positions = np.flatnonzero(mask.to_numpy()) if mask is not None else np.arange(len(self.df))
+            if sort:
+                values = self.df[sort].iloc[positions].reset_index(drop=True)
+                positions = positions[values.sort_values(ascending=not descending, kind='stable').index.to_numpy()]
+            self._orders[key] = positions
+            while len(self._orders) > 4:
+                self._orders.popitem(last=False)
+        return positions
+
+    def _mask(self, filters):
+        mask = None
+        for column, values in filters.items():
+            if isinstance(values, dict):
+                # Half-open date range, see planner.period_range
+                series = self.df[column]
+                condition = (series >= pd.Timestamp(values["start"])) & (series < pd.Timestamp(values["end"]))
+            else:
+                condition = self.df[column].isin(values)
+            mask = condition if mask is None else mask & condition
+        return mask
+
+    def run(self, plan):
+        """Execute a query plan (see planner) as one vectorized pandas expression"""
+        df = self.df
+        mask = self._mask(plan["filters"])
+        group_by = ([plan["time"]] if plan["time"] else []) + plan["dimensions"]
+        columns = list(dict.fromkeys(group_by + plan["measures"]))
+        data = df.loc[mask, columns] if mask is not None else df[columns]
+
+        keys = [data[column] for column in plan["dimensions"]]
+        if plan["time"]:
+            keys.insert(0, data[plan["time"]].dt.to_period(plan["grain"]))
+        if not keys:
+            values = {measure: [len(data) if plan["agg"] == 'size' else data[measure].agg(plan["agg"])]
+                      for measure in plan["measures"]}
+            return pd.DataFrame(values, index=pd.Index(['All'], name='Total'))
+        grouped = data.groupby(keys, observed=True)
+        if plan["agg"] == 'size':
+            sizes = grouped.size()
+            return pd.DataFrame({measure: sizes for measure in plan["measures"]})
+        return grouped[plan["measures"]].agg(plan["agg"])
+
+
+class ArrowBackend:
+    """Serves queries straight from a Parquet or Arrow IPC file on local disk
+
+    IPC files are memory-mapped, only the columns a query touches are read and
+    the groupby runs inside Arrow's streaming engine, so the table never has
+    to be materialized as a DataFrame.
+    """
+
+    # pandas aggregation name -> (scalar function, grouped function). Medians
+    # are not here: Arrow only estimates them, so they are taken in pandas
+    # from the scanned columns (see _median).
+    AGGREGATIONS = {
+        'sum': ('sum', 'hash_sum'),
+        'mean': ('mean', 'hash_mean'),
+        'min': ('min', 'hash_min'),
+        'max': ('max', 'hash_max'),
+        'count': ('count', 'hash_count'),
+        'size': ('count', 'hash_count'),
+        'nunique': ('count_distinct', 'hash_count_distinct'),
+    }
+    # pandas period grain -> Arrow temporal unit
+    GRAINS = {'D': 'day', 'W': 'week', 'M': 'month', 'Q': 'quarter', 'Y': 'year'}
+
+    def __init__(self, path):
+        import pyarrow.dataset as ds
+        import pyarrow.fs as fs
+
+        self.path = path
+        file_format = 'parquet' if path.endswith('.parquet') else 'ipc'
+        self.dataset = ds.dataset(path, format=file_format, filesystem=fs.LocalFileSystem(use_mmap=True))
+        self._num_rows = None
+
+    @property
+    def num_rows(self):
+        if self._num_rows is None:
+            self._num_rows = self.dataset.count_rows()
+        return self._num_rows
+
+    @property
+    def dtypes(self):
+        empty = self.dataset.schema.empty_table().to_pandas()
+        return {col: str(dtype) for col, dtype in empty.dtypes.items()}
+
+    def memory_usage(self):
+        # Pages are mapped from disk on demand rather than held by the process
+        return None
+
+    def head(self, n):
+        return self.dataset.head(n).to_pandas()
+
+    def to_pandas(self):
+        return self.dataset.to_table().to_pandas()
+
+    def _decoded(self, column):
+        """Field expression with dictionary columns cast back to their values"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        field_type = self.dataset.schema.field(column).type
+        if pa.types.is_dictionary(field_type):
+            return pc.field(column).cast(field_type.value_type)
+        return pc.field(column)
+
+    def aggregate(self, dimension, measure, grain=None, agg='sum'):
+        import pyarrow.acero as ac
+        import pyarrow.compute as pc
+
+        value = self._decoded(measure) if agg == 'nunique' else pc.field(measure)
+        columns, names = [value], ['value']
+        if dimension is not None:
+            key = pc.field(dimension)
+            if grain:
+                key = pc.floor_temporal(key, unit=self.GRAINS[grain])
+            columns.insert(0, key)
+            names.insert(0, 'key')
+
+        scanned = list({measure, dimension} - {None})
+        nodes = [
+            ac.Declaration('scan', ac.ScanNodeOptions(self.dataset, columns=scanned)),
+            ac.Declaration('project', ac.ProjectNodeOptions(columns, names)),
+        ]
+        if agg == 'median':
+            frame = self._median(nodes, names[:-1], ['value'], [measure])
+            if dimension is None:
+                return frame[measure].iloc[0]
+        else:
+            scalar_func, hash_func = self.AGGREGATIONS[agg]
+            # `size` counts nulls too, like pandas
+            options = pc.CountOptions(mode='all') if agg == 'size' else None
+            nodes.append(ac.Declaration('aggregate', ac.AggregateNodeOptions(
+                [('value', hash_func if dimension else scalar_func, options, measure)],
+                keys=['key'] if dimension else None,
+            )))
+            table = ac.Declaration.from_sequence(nodes).to_table()
+            if dimension is None:
+                result = table.column(measure)[0].as_py()
+                return pd.Timestamp(result) if isinstance(result, datetime.datetime) else result
+            frame = table.to_pandas()
+        index = pd.Index(frame['key'], name=dimension)
+        if grain:
+            index = pd.PeriodIndex(pd.to_datetime(frame['key']).dt.to_period(grain), name=dimension)
+        return pd.Series(frame[measure].to_numpy(), index=index, name=measure).sort_index()
+
+    def _condition(self, filters):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        condition = None
+        for column, values in (filters or {}).items():
+            if isinstance(values, dict):
+                # Half-open date range; compared in the column's own timestamp type
+                field_type = self.dataset.schema.field(column).type
+                start, end = (pa.scalar(pd.Timestamp(values[bound]).to_pydatetime(), type=field_type)
+                              for bound in ("start", "end"))
+                expression = (pc.field(column) >= start) & (pc.field(column) < end)
+            else:
+                # The value set is typed like the column, e.g. timestamps in its unit
+                expression = self._decoded(column).isin(pa.array(values, type=self._value_type(column)))
+            condition = expression if condition is None else condition & expression
+        return condition
+
+    def count_rows(self, filters=None):
+        if not filters:
+            return self.num_rows
+        return self.dataset.count_rows(filter=self._condition(filters))
+
+    def page(self, filters=None, sort=None, descending=False, offset=0, limit=20):
+        """Rows `offset` to `offset + limit` of the filtered, sorted table and the filtered row count
+
+        The page is an Arrow table. Unsorted pages stream record batches up to
+        the page; sorted pages select the top `offset + limit` rows reading
+        only the sort and filter columns, then fetch just the page's rows.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        condition = self._condition(filters)
+        if not sort:
+            batches, seen, taken = [], 0, 0
+            for batch in self.dataset.to_batches(filter=condition):
+                start = max(offset - seen, 0)
+                seen += batch.num_rows
+                if start >= batch.num_rows:
+                    continue
+                batches.append(batch.slice(start, limit - taken))
+                taken += batches[-1].num_rows
+                if taken >= limit:
+                    break
+            return pa.Table.from_batches(batches, self.dataset.schema), self.count_rows(filters)
+        table = self.dataset.to_table(columns=list(dict.fromkeys([sort] + list(filters or {}))))
+        table = table.append_column('__row', pa.array(np.arange(table.num_rows)))
+        if condition is not None:
+            table = table.filter(condition)
+        keys = table.select([sort]).cast(pa.schema([pa.field(sort, self._value_type(sort))]))
+        order = 'descending' if descending else 'ascending'
+        indices = pc.select_k_unstable(keys, k=min(offset + limit, table.num_rows), sort_keys=[(sort, order)])
+        return self.dataset.take(table.column('__row').take(indices[offset:])), table.num_rows
+
+    def _value_type(self, column):
+        import pyarrow as pa
+
+        field_type = self.dataset.schema.field(column).type
+        return field_type.value_type if pa.types.is_dictionary(field_type) else field_type
+
+    def iter_chunks(self, columns, filters=None, chunk_rows=250_000):
+        """Yield the rows matching `filters` as DataFrames, one record batch at a time"""
+        batches = self.dataset.to_batches(columns=columns, filter=self._condition(filters), batch_size=chunk_rows)
+        for batch in batches:
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def run(self, plan):
+        """Execute a query plan (see planner) inside Arrow, filters pushed into the scan"""
+        import pyarrow.acero as ac
+        import pyarrow.compute as pc
+
+        condition = self._condition(plan["filters"])
+
+        group_by = ([plan["time"]] if plan["time"] else []) + plan["dimensions"]
+        keys = [pc.field(column) for column in group_by]
+        if plan["time"]:
+            keys[0] = pc.floor_temporal(keys[0], unit=self.GRAINS[plan["grain"]])
+        key_names = [f"key{position}" for position in range(len(keys))]
+        value_names = [f"value{position}" for position in range(len(plan["measures"]))]
+
+        scan_options = {"columns": list(dict.fromkeys(group_by + plan["measures"] + list(plan["filters"])))}
+        nodes = []
+        if condition is not None:
+            scan_options["filter"] = condition
+        nodes.append(ac.Declaration('scan', ac.ScanNodeOptions(self.dataset, **scan_options)))
+        if condition is not None:
+            # The scan only uses the filter to skip row groups; rows are filtered here
+            nodes.append(ac.Declaration('filter', ac.FilterNodeOptions(condition)))
+        measures = [
+            self._decoded(measure) if plan["agg"] == 'nunique' else pc.field(measure)
+            for measure in plan["measures"]
+        ]
+        nodes.append(ac.Declaration('project', ac.ProjectNodeOptions(
+            keys + measures, key_names + value_names,
+        )))
+        if plan["agg"] == 'median':
+            frame = self._median(nodes, key_names, value_names, plan["measures"])
+        else:
+            scalar_func, hash_func = self.AGGREGATIONS[plan["agg"]]
+            options = pc.CountOptions(mode='all') if plan["agg"] == 'size' else None
+            nodes.append(ac.Declaration('aggregate', ac.AggregateNodeOptions(
+                [(value, hash_func if keys else scalar_func, options, measure)
+                 for value, measure in zip(value_names, plan["measures"])],
+                keys=key_names or None,
+            )))
+            frame = ac.Declaration.from_sequence(nodes).to_table().to_pandas()
+
+        if not keys:
+            frame.index = pd.Index(['All'], name='Total')
+            return frame[plan["measures"]]
+        if plan["time"]:
+            frame[key_names[0]] = pd.to_datetime(frame[key_names[0]]).dt.to_period(plan["grain"])
+        frame = frame.rename(columns=dict(zip(key_names, group_by))).set_index(group_by)
+        return frame[plan["measures"]].sort_index()
+
+    @staticmethod
+    def _median(nodes, key_names, value_names, measures):
+        """Exact medians of the projected values, grouped by the key columns
+
+        Only the projected columns are read into pandas.
+        """
+        import pyarrow.acero as ac
+
+        frame = ac.Declaration.from_sequence(nodes).to_table().to_pandas()
+        frame = frame.rename(columns=dict(zip(value_names, measures)))
+        if not key_names:
+            return frame[measures].median().to_frame().T
+        return frame.groupby(key_names, sort=False, dropna=False, observed=True)[measures].median().reset_index()
+
+
+class RollupCache:
+    """Materialized aggregates for one dataset version, built once on first use"""
+
+    def __init__(self, backend, version=0, name=None):
+        if isinstance(backend, pd.DataFrame):
+            backend = InMemoryBackend(backend)
+        self.backend = backend
+        self.version = version
+        self.name = name
+        self._cache = {}
+        # Key -> Future of a value being built; later callers wait on it
+        self._building = {}
+        # Guards the two dicts only; values are built outside it
+        self._lock = threading.Lock()
+
+    # Key prefix -> updater(key, value, batch backend) for values cached by
+    # other modules; returns the updated value, or None to drop it
+    updaters = {}
+
+    def get(self, dimension, measure, grain=None, agg='sum'):
+        """Aggregate `measure` by `dimension` (bucketed to `grain` for dates)
+
+        With no dimension the result is a scalar over the whole dataset.
+        Means are derived from sum and count so appends can update them.
+        """
+        if agg == 'mean':
+            return self.cached(
+                (dimension, measure, grain, agg),
+                lambda: self.get(dimension, measure, grain, 'sum') / self.get(dimension, measure, grain, 'count'),
+            )
+        return self.cached(
+            (dimension, measure, grain, agg),
+            lambda: self.backend.aggregate(dimension, measure, grain, agg),
+        )
+
+    def extend(self, backend, batch, version):
+        """Rollups for `backend`, which holds this dataset plus the rows of `batch`
+
+        Sums, counts, minimums and maximums are updated from the batch alone;
+        anything else (means, distinct counts...) is rebuilt on first use.
+        """
+        rollups = RollupCache(backend, version, self.name)
+        batch = InMemoryBackend(batch)
+        with self._lock:
+            cache = dict(self._cache)
+        for key, value in cache.items():
+            if len(key) == 4:
+                value = merge_delta(value, batch.aggregate(*key), key[3]) if key[3] in DELTA_AGGS else None
+            elif key[0] in self.updaters:
+                value = self.updaters[key[0]](key, value, batch)
+            else:
+                value = None
+            if value is not None:
+                rollups._cache[key] = value
+        return rollups
+
+    def profile(self):
+        """Cached schema and column statistics, see build_profile"""
+        return self.cached(("profile",), lambda: build_profile(self))
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def cached(self, key, build):
+        """Return the value cached under `key`, building it on first use
+
+        Different keys build concurrently; callers asking for a key that is
+        being built wait for that build instead of starting another.
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            pending = self._building.get(key)
+            if pending is None:
+                pending = self._building[key] = Future()
+                building = True
+            else:
+                building = False
+        if not building:
+            return pending.result()
+        try:
+            value = build()
+        except BaseException as error:
+            with self._lock:
+                del self._building[key]
+            pending.set_exception(error)
+            raise
+        with self._lock:
+            self._cache[key] = value
+            del self._building[key]
+        pending.set_result(value)
+        return value
+
+
+class DatasetRegistry:
+    """Process-wide store that loads each dataset once and shares it across sessions"""
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, source=None, normalize=True):
+        """Register a dataset loader; `source` is an optional file watched for changes
+
+        The loader returns either a DataFrame (served from memory) or a backend
+        such as ArrowBackend (served from disk).
+        """
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = {
+                    "name": name,
+                    "loader": loader,
+                    "source": source,
+                    "normalize": normalize,
+                    "memory": None,
+                    "backend": None,
+                    "rollups": None,
+                    "version": 0,
+                    "mtime": None,
+                    "checked_at": 0.0,
+                    "reload_lock": threading.Lock(),
+                }
+
+    def register_file(self, path, name=None):
+        """Register a CSV, Parquet or Arrow file under `name` (its file name by default)
+
+        Columnar files are queried in place instead of being loaded into
+        memory. The dataset is reloaded when the file changes.
+        """
+        name = name or os.path.basename(path)
+        if path.endswith(('.parquet', '.arrow', '.feather')):
+            self.register(name, lambda: ArrowBackend(path), source=path)
+        else:
+            self.register(name, lambda: load_dataset_file(path), source=path)
+        return name
+
+    def register_directory(self, directory):
+        """Register every dataset file in `directory`, in name order; returns their names"""
+        return [
+            self.register_file(os.path.join(directory, filename))
+            for filename in sorted(os.listdir(directory))
+            if filename.endswith(DATASET_EXTENSIONS) and not filename.startswith('.')
+        ]
+
+    def on_reload(self, callback):
+        """Call `callback(name, version)` whenever a dataset is (re)loaded"""
+        self._listeners.append(callback)
+
+    def names(self):
+        with self._lock:
+            return list(self._entries)
+
+    def is_loaded(self, name):
+        """Whether the dataset can be served without waiting for it to load"""
+        return self._entry(name)["backend"] is not None
+
+    def backend(self, name):
+        """Backend serving the current version of the dataset"""
+        return self._current(name)["backend"]
+
+    def rollups(self, name):
+        """Rollup cache for the current version of the dataset"""
+        return self._current(name)["rollups"]
+
+    def memory_report(self, name):
+        """Memory used by the dataset before and after normalization, in bytes
+
+        None when the dataset is served from disk.
+        """
+        return self._current(name)["memory"]
+
+    def version(self, name):
+        """Version number that increases every time the dataset is (re)loaded"""
+        return self._entry(name)["version"]
+
+    def reload(self, name):
+        """Force a reload of the dataset from its loader"""
+        self._load(self._entry(name), force=True)
+
+    def append(self, name, batch):
+        """Append a DataFrame of new rows to an in-memory dataset and return its new version
+
+        Rollups are carried over and updated by delta instead of being
+        recomputed, so only the new rows are aggregated.
+        """
+        entry = self._current(name)
+        with entry["reload_lock"]:
+            backend = entry["backend"]
+            if not isinstance(backend, InMemoryBackend):
+                raise TypeError(f"Dataset {name} is served from disk; append to its files instead")
+            if not len(batch):
+                return entry["version"]
+            frame, batch = append_rows(backend.df, batch)
+            backend = InMemoryBackend(frame)
+            rollups = entry["rollups"].extend(backend, batch, entry["version"] + 1)
+            memory = dict(entry["memory"] or {}, memory_after=backend.memory_usage())
+            with self._lock:
+                entry["backend"] = backend
+                entry["memory"] = memory
+                entry["version"] += 1
+                entry["rollups"] = rollups
+                version = entry["version"]
+        for callback in self._listeners:
+            callback(name, version)
+        return version
+
+    def watch(self, name, directory, interval=None):
+        """Append every new CSV/Parquet file dropped into `directory` to a dataset
+
+        Files are picked up once, in name order, after they have not changed
+        for one polling interval; write them elsewhere and move them in to be
+        safe. Returns an Event that stops the watcher when set.
+        """
+        interval = interval or self.check_interval
+        stop = threading.Event()
+        seen = set()
+
+        def poll():
+            while not stop.wait(interval):
+                now = time.time()
+                for filename in sorted(os.listdir(directory)):
+                    path = os.path.join(directory, filename)
+                    if filename.startswith('.') or not filename.endswith(('.csv', '.parquet')) or path in seen:
+                        continue
+                    try:
+                        if now - os.path.getmtime(path) < interval:
+                            continue
+                        seen.add(path)
+                        self.append(name, load_dataset_file(path))
+                    except Exception:
+                        logger.exception("Could not ingest %s", path)
+
+        threading.Thread(target=poll, name=f"watch-{name}", daemon=True).start()
+        return stop
+
+    def _current(self, name):
+        entry = self._entry(name)
+        if entry["backend"] is None or self._source_changed(entry):
+            self._load(entry)
+        return entry
+
+    def _entry(self, name):
+        with self._lock:
+            if name not in self._entries:
+                raise KeyError(f"Unknown dataset: {name}")
+            return self._entries[name]
+
+    def _source_mtime(self, entry):
+        try:
+            return os.path.getmtime(entry["source"])
+        except OSError:
+            return None
+
+    def _source_changed(self, entry):
+        if entry["source"] is None:
+            return False
+        now = time.monotonic()
+        if now - entry["checked_at"] < self.check_interval:
+            return False
+        entry["checked_at"] = now
+        mtime = self._source_mtime(entry)
+        return mtime is not None and mtime != entry["mtime"]
+
+    def _load(self, entry, force=False):
+        # Only one thread rebuilds; the others keep serving the current version
+        blocking = entry["backend"] is None
+        if not entry["reload_lock"].acquire(blocking=blocking):
+            return
+        try:
+            mtime = self._source_mtime(entry) if entry["source"] else None
+            if entry["backend"] is not None and not force and mtime == entry["mtime"]:
+                return
+            backend = entry["loader"]()
+            memory = None
+            if isinstance(backend, pd.DataFrame):
+                if entry["normalize"]:
+                    frame, memory = normalize_dataset(backend)
+                else:
+                    frame = backend
+                    memory = {"memory_before": InMemoryBackend(frame).memory_usage()}
+                    memory["memory_after"] = memory["memory_before"]
+                backend = InMemoryBackend(frame)
+            # Swap the new version in atomically; existing views keep the old data
+            with self._lock:
+                entry["backend"] = backend
+                entry["mtime"] = mtime
+                entry["memory"] = memory
+                entry["version"] += 1
+                entry["rollups"] = RollupCache(backend, entry["version"], entry["name"])
+                version = entry["version"]
+        finally:
+            entry["reload_lock"].release()
+        for callback in self._listeners:
+            callback(entry["name"], version)
@@ -0,0 +1,230 @@
+import inspect
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Job states; the last four are final
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, TIMED_OUT = (
+    "queued", "running", "done", "failed", "cancelled", "timed_out"
+)
+FINAL_STATES = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+
+class QueryExecutor:
+    """Runs queries on a bounded thread pool so script runs never block on them
+
+    Each user has at most `per_user_limit` jobs running; further jobs wait in
+    a per-user queue so one user cannot take every worker. Waiting jobs are
+    started round-robin across users as workers free up. Jobs still
+    unfinished `timeout` seconds after they were due to start are reported
+    as timed out. A job function may be a generator to stream partial results.
+    Threads cannot be interrupted, so a cancelled or timed-out job that is
+    already running finishes in the background and its result is discarded.
+
+    Jobs carry an estimated cost (see analytics.question_cost). At most
+    `heavy_limit` jobs costing `heavy_cost` or more run at once, leaving
+    workers free for cheap questions, and once `max_queued` jobs are waiting
+    heavy ones are shed. A job can also be given a delay before which it
+    does not start, e.g. by a rate limiter (see admission).
+    """
+
+    def __init__(self, max_workers=4, per_user_limit=1, timeout=30.0, max_queued=32, heavy_cost=5.0, heavy_limit=None):
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self.timeout = timeout
+        self.max_queued = max_queued
+        self.heavy_cost = heavy_cost
+        self.heavy_limit = max(1, max_workers - 1) if heavy_limit is None else heavy_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query")
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._running = {}
+        self._heavy = 0
+        self._shed = 0
+        # User -> queued job ids; users are served in turn, front first
+        self._waiting = OrderedDict()
+        # Re-entrant: future callbacks may run inline while the lock is held
+        self._lock = threading.RLock()
+
+    def submit(self, user, fn, *args, cost=1.0, delay=0.0, **kwargs):
+        """Queue `fn(*args, **kwargs)` for `user` and return a job id to poll
+
+        `cost` and `delay` (seconds) are used by the executor, not passed to
+        `fn`. Returns None when the job is shed.
+        """
+        with self._lock:
+            self._prune()
+            heavy = cost >= self.heavy_cost
+            if heavy and self._queued() >= self.max_queued:
+                self._shed += 1
+                return None
+            job_id = next(self._ids)
+            now = time.monotonic()
+            job = {
+                "id": job_id,
+                "user": user,
+                "call": (fn, args, kwargs),
+                "cost": cost,
+                "heavy": heavy,
+                "status": QUEUED,
+                "submitted": now,
+                "not_before": now + delay,
+                "started": None,
+                "finished": None,
+                "future": None,
+                "partial": None,
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job_id] = job
+            self._waiting.setdefault(user, deque()).append(job_id)
+            self._schedule()
+        if delay > 0:
+            timer = threading.Timer(delay, self._wake)
+            timer.daemon = True
+            timer.start()
+        return job_id
+
+    def poll(self, job_id):
+        """Snapshot of a job: status, result and error (None for unknown jobs)
+
+        Queued jobs also report how many jobs are ahead of them and how many
+        seconds remain before they may start.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            now = time.monotonic()
+            if job["status"] not in FINAL_STATES and now - job["not_before"] > self.timeout:
+                self._cancel(job, TIMED_OUT)
+            snapshot = {key: job[key] for key in ("id", "status", "partial", "result", "error", "submitted", "started", "finished")}
+            if job["status"] == QUEUED:
+                snapshot["starts_in"] = max(0.0, job["not_before"] - now)
+                snapshot["ahead"] = sum(
+                    1 for waiting in self._waiting.values() for other in waiting if other < job_id
+                )
+            if job["status"] in FINAL_STATES:
+                # Final results are handed out once; keep the job table small
+                self._jobs.pop(job_id, None)
+            return snapshot
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] not in FINAL_STATES:
+                self._cancel(job, CANCELLED)
+            self._jobs.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "running": sum(self._running.values()),
+                "heavy_running": self._heavy,
+                "queued": self._queued(),
+                "delayed": sum(
+                    1 for waiting in self._waiting.values() for job_id in waiting
+                    if self._jobs[job_id]["not_before"] > now
+                ),
+                "shed": self._shed,
+            }
+
+    def _queued(self):
+        return sum(len(waiting) for waiting in self._waiting.values())
+
+    def _prune(self):
+        # Finished jobs whose session never came back for the result
+        expired = time.monotonic() - 10 * self.timeout
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["status"] in FINAL_STATES and job["finished"] < expired]:
+            del self._jobs[job_id]
+
+    def _wake(self):
+        # A delayed job is due
+        with self._lock:
+            self._schedule()
+
+    def _schedule(self):
+        # Start waiting jobs while workers are free: users with the fewest
+        # running jobs first, taking turns among equals
+        now = time.monotonic()
+        while sum(self._running.values()) < self.max_workers:
+            ready = [
+                user for user, waiting in self._waiting.items()
+                if self._running.get(user, 0) < self.per_user_limit
+                and self._jobs[waiting[0]]["not_before"] <= now
+                and (not self._jobs[waiting[0]]["heavy"] or self._heavy < self.heavy_limit)
+            ]
+            if not ready:
+                return
+            user = min(ready, key=lambda user: self._running.get(user, 0))
+            waiting = self._waiting[user]
+            job = self._jobs[waiting.popleft()]
+            if waiting:
+                # Served: to the back of the line
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            self._dispatch(job)
+
+    def _dispatch(self, job):
+        self._running[job["user"]] = self._running.get(job["user"], 0) + 1
+        if job["heavy"]:
+            self._heavy += 1
+        job["future"] = self._pool.submit(self._run, job)
+        job["future"].add_done_callback(lambda future: self._finished(job))
+
+    def _run(self, job):
+        with self._lock:
+            if job["status"] != QUEUED:
+                return None
+            job["status"] = RUNNING
+            job["started"] = time.monotonic()
+            fn, args, kwargs = job["call"]
+        result = fn(*args, **kwargs)
+        if not inspect.isgenerator(result):
+            return result
+        # Streaming job: each yielded value is a partial result pollers can show,
+        # the last one is the final result. Cancelling stops the generator.
+        final = None
+        for final in result:
+            with self._lock:
+                if job["status"] != RUNNING:
+                    result.close()
+                    return None
+                job["partial"] = final
+        return final
+
+    def _finished(self, job):
+        future = job["future"]
+        with self._lock:
+            self._running[job["user"]] -= 1
+            if not self._running[job["user"]]:
+                del self._running[job["user"]]
+            if job["heavy"]:
+                self._heavy -= 1
+            if job["status"] == RUNNING:
+                job["finished"] = time.monotonic()
+                error = future.exception()
+                if error is None:
+                    job["status"], job["result"] = DONE, future.result()
+                else:
+                    job["status"], job["error"] = FAILED, error
+            job["call"] = None
+            self._schedule()
+
+    def _cancel(self, job, status):
+        job["status"] = status
+        job["finished"] = time.monotonic()
+        job["call"] = None
+        waiting = self._waiting.get(job["user"])
+        if waiting and job["id"] in waiting:
+            waiting.remove(job["id"])
+            if not waiting:
+                del self._waiting[job["user"]]
+        elif job["future"] is not None:
+            # Frees the worker if the job never started; a running one is discarded
+            job["future"].cancel()
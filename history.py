@@ -0,0 +1,86 @@
+import abc
+import json
+import sqlite3
+import threading
+import time
+
+# Keys that only matter while a message is being streamed
+TRANSIENT_KEYS = ("id", "stage")
+
+
+class ConversationStore(abc.ABC):
+    """Persistent chat history, one conversation per user
+
+    Messages are stored as compact records: text, code and result
+    descriptors, never figures or frames. Each stored message gets an
+    increasing integer id, returned in its "id" key when loaded.
+    """
+
+    @abc.abstractmethod
+    def append(self, user, message):
+        """Store a message and return its id"""
+
+    @abc.abstractmethod
+    def load(self, user, before=None, limit=20):
+        """The `limit` most recent messages older than id `before`, oldest first"""
+
+    @abc.abstractmethod
+    def count(self, user, before=None):
+        """Number of stored messages, optionally only those older than id `before`"""
+
+    @abc.abstractmethod
+    def clear(self, user):
+        """Delete every stored message of `user`"""
+
+
+def encode_message(message):
+    return json.dumps({key: value for key, value in message.items() if key not in TRANSIENT_KEYS}, default=str)
+
+
+class SQLiteStore(ConversationStore):
+    """Conversation store in an embedded SQLite database (":memory:" for a throwaway one)"""
+
+    def __init__(self, path):
+        self.path = path
+        # One connection shared by all sessions; writes are serialized by the lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " user TEXT NOT NULL,"
+                " created REAL NOT NULL,"
+                " record TEXT NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS messages_user ON messages (user, id)")
+
+    def append(self, user, message):
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO messages (user, created, record) VALUES (?, ?, ?)",
+                (user, time.time(), encode_message(message)),
+            )
+            return cursor.lastrowid
+
+    def load(self, user, before=None, limit=20):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, record FROM messages WHERE user = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (user, before if before is not None else 2 ** 63 - 1, limit),
+            ).fetchall()
+        return [dict(json.loads(record), id=message_id) for message_id, record in reversed(rows)]
+
+    def count(self, user, before=None):
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM messages WHERE user = ? AND id < ?",
+                (user, before if before is not None else 2 ** 63 - 1),
+            ).fetchone()
+        return count
+
+    def clear(self, user):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM messages WHERE user = ?", (user,))
@@ -0,0 +1,93 @@
+import re
+import threading
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_token(token):
+    """Crude plural folding so 'regions'/'region' and 'categories'/'category' match"""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [normalize_token(token) for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+class IntentRouter:
+    """Declarative intent registry compiled into a single token index
+
+    Each intent lists keyword groups with a weight, e.g.
+    ``{"revenue": (["revenue", "sales"], 1.0)}``. A query scores the best
+    weight it hits in each group; intents missing a required group are
+    skipped. Every intent is scored in one pass over the query tokens, so
+    routing cost depends on the query, not on the number of intents.
+    """
+
+    def __init__(self):
+        self._intents = []
+        self._index = None
+        self._lock = threading.Lock()
+
+    def intent(self, name, groups, required=(), defaults=None):
+        """Decorator registering `handler` for an intent
+
+        `defaults` is the query plan the intent answers when the question
+        leaves parts out (see planner.complete_plan).
+        """
+        def decorator(handler):
+            self.add(name, groups, handler, required, defaults)
+            return handler
+        return decorator
+
+    def add(self, name, groups, handler, required=(), defaults=None):
+        max_score = sum(weight for _, weight in groups.values())
+        with self._lock:
+            self._intents.append({
+                "name": name,
+                "groups": groups,
+                "required": tuple(required),
+                "handler": handler,
+                "defaults": defaults,
+                "max_score": max_score,
+            })
+            self._index = None
+
+    def _compile(self):
+        # token -> [(intent position, group name, weight)]
+        index = {}
+        for position, intent in enumerate(self._intents):
+            for group, (keywords, weight) in intent["groups"].items():
+                for keyword in keywords:
+                    index.setdefault(normalize_token(keyword), []).append((position, group, weight))
+        return index
+
+    def route(self, text):
+        """Return (intent, confidence) for the best match, or (None, 0.0)"""
+        with self._lock:
+            if self._index is None:
+                self._index = self._compile()
+            index, intents = self._index, self._intents
+
+        hits = {}
+        for token in tokenize(text):
+            for position, group, weight in index.get(token, ()):
+                groups = hits.setdefault(position, {})
+                groups[group] = max(groups.get(group, 0.0), weight)
+
+        best, best_score = None, 0.0
+        for position, groups in hits.items():
+            intent = intents[position]
+            if any(group not in groups for group in intent["required"]):
+                continue
+            score = sum(groups.values())
+            # Ties go to the intent registered first
+            if score > best_score or (score == best_score and best is not None and position < best[0]):
+                best, best_score = (position, intent), score
+        if best is None:
+            return None, 0.0
+        intent = best[1]
+        return intent, best_score / intent["max_score"]
@@ -0,0 +1,235 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency histogram bucket upper bounds in seconds, Prometheus-style
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Sessions not seen for this long are dropped from the memory gauge
+SESSION_TTL = 60 * 60
+
+logger = logging.getLogger("cognichat.metrics")
+
+_enabled = os.environ.get("COGNICHAT_METRICS", "").lower() in ("1", "true", "yes")
+_histograms = {}
+_gauges = {}
+_sessions = {}
+_startup = {}
+_lock = threading.Lock()
+_NOOP = nullcontext()
+
+
+def enabled():
+    return _enabled
+
+
+def set_enabled(flag):
+    """Turn collection on or off for the whole process"""
+    global _enabled
+    _enabled = bool(flag)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in
+
+        Quantiles in the overflow bucket are reported as the largest bound,
+        i.e. as a lower bound rather than infinity.
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+
+class _Stage:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+def stage(name, **labels):
+    """Context manager timing one stage of answering or rendering a question
+
+    A shared no-op when collection is off, so instrumented hot paths cost a
+    flag check.
+    """
+    if not _enabled:
+        return _NOOP
+    return _Stage(name, labels)
+
+
+def timed(name, **labels):
+    """Decorator recording every call of a function as stage `name`"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, seconds, **labels):
+    """Record a stage duration and log it as one JSON line"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": "stage", "stage": name, "seconds": round(seconds, 6), **labels}))
+
+
+def gauge(name, read, help="", **labels):
+    """Register `read()` as a gauge, sampled whenever metrics are exported"""
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = (read, help)
+
+
+def track_session(session_id, size):
+    """Record the approximate memory held by one user session, in bytes"""
+    now = time.monotonic()
+    with _lock:
+        _sessions[session_id] = (size, now)
+        for stale in [key for key, (_, seen) in _sessions.items() if now - seen > SESSION_TTL]:
+            del _sessions[stale]
+
+
+def record_startup(phase, seconds):
+    """Record how long a startup phase took; only the first run of each phase counts
+
+    Startup timings are kept even when collection is off: they are paid once
+    per process.
+    """
+    with _lock:
+        if phase in _startup:
+            return
+        _startup[phase] = seconds
+    logger.info(json.dumps({"event": "startup", "phase": phase, "seconds": round(seconds, 6)}))
+
+
+def startup():
+    """{phase: seconds} for the startup phases seen so far"""
+    with _lock:
+        return dict(_startup)
+
+
+def histograms():
+    """{(stage, labels): Histogram} snapshot"""
+    with _lock:
+        return dict(_histograms)
+
+
+def sessions():
+    """{session id: bytes} for the sessions seen recently"""
+    with _lock:
+        return {key: size for key, (size, _) in _sessions.items()}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _sessions.clear()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    lines = [
+        "# HELP cognichat_stage_seconds Time spent in each stage of answering and rendering questions",
+        "# TYPE cognichat_stage_seconds histogram",
+    ]
+    for (name, labels), histogram in sorted(histograms().items()):
+        labels = (("stage", name),) + labels
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"cognichat_stage_seconds_bucket{_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"cognichat_stage_seconds_sum{_labels(labels)} {histogram.sum}")
+        lines.append(f"cognichat_stage_seconds_count{_labels(labels)} {histogram.count}")
+
+    lines.append("# HELP cognichat_startup_seconds Time taken by each phase of process startup")
+    lines.append("# TYPE cognichat_startup_seconds gauge")
+    for phase, seconds in sorted(startup().items()):
+        lines.append(f"cognichat_startup_seconds{_labels((('phase', phase),))} {seconds}")
+
+    lines.append("# HELP cognichat_session_bytes Approximate memory held by each session")
+    lines.append("# TYPE cognichat_session_bytes gauge")
+    for session_id, size in sorted(sessions().items()):
+        lines.append(f"cognichat_session_bytes{_labels((('session', session_id),))} {size}")
+
+    with _lock:
+        gauges = sorted(_gauges.items(), key=lambda item: item[0])
+    described = set()
+    for (name, labels), (read, help) in gauges:
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{_labels(labels)} {read()}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    """Expose /metrics for Prometheus to scrape on a background thread
+
+    The endpoint has no authentication, so it only listens on the loopback
+    interface unless another `host` is given.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
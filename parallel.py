@@ -0,0 +1,207 @@
+"""Partitioned aggregation of large in-memory datasets on a process pool
+
+The columns a query needs are copied once per dataset version into shared
+memory segments. Worker processes attach to them without copying, aggregate
+one row range each (see planner.partial_aggregate) and send back only their
+small partial results, which the caller merges. Arrow-backed datasets do not
+need this: their scans and aggregations already run multithreaded inside
+Arrow.
+"""
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from dataset_engine import InMemoryBackend
+
+# Datasets smaller than this are aggregated in-process; starting tasks costs more
+PARALLEL_MIN_ROWS = 1_000_000
+# Categoricals with more categories than this are not shared (categories are
+# sent to the workers with every task)
+MAX_SHARED_CATEGORIES = 100_000
+# Segments a worker keeps attached, across datasets; segments of superseded
+# versions are detached as soon as a newer version is seen
+MAX_ATTACHED = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def worker_count():
+    """Worker processes to use: COGNICHAT_WORKERS, or one per core; 1 or less disables"""
+    return int(os.environ.get("COGNICHAT_WORKERS") or os.cpu_count() or 1)
+
+
+def get_pool():
+    """Process pool shared by every query, started on first use
+
+    Workers are spawned rather than forked: the server process runs many
+    threads, which fork does not copy safely.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=worker_count(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _release(segments):
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+
+
+class SharedColumns:
+    """Columns of one in-memory dataset version, copied into shared memory on demand
+
+    Segments are unlinked when this object is garbage collected, i.e. once
+    the dataset version it belongs to is no longer served.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self._specs = {}
+        self._segments = []
+        self._lock = threading.Lock()
+        weakref.finalize(self, _release, self._segments)
+
+    def specs(self, columns):
+        """{column: spec} for the workers, or None if a column cannot be shared"""
+        with self._lock:
+            for column in columns:
+                if column not in self._specs:
+                    self._specs[column] = self._share(self.df[column])
+            specs = {column: self._specs[column] for column in columns}
+        return None if any(spec is None for spec in specs.values()) else specs
+
+    def _share(self, series):
+        categories = None
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            if len(series.cat.categories) > MAX_SHARED_CATEGORIES:
+                return None
+            categories = series.cat.categories
+            values = series.cat.codes.to_numpy()
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufM':
+            values = series.to_numpy()
+        else:
+            # Strings and extension types have no flat buffer to share
+            return None
+        segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self._segments.append(segment)
+        np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[:] = values
+        return segment.name, values.dtype.str, len(values), categories
+
+
+def shared_columns(rollups):
+    """Shared copy of a dataset version's columns, cached with its rollups"""
+    return rollups.cached(("shared_columns",), lambda: SharedColumns(rollups.backend.df))
+
+
+def partitions(df, parts, time=None):
+    """Row ranges splitting a frame into `parts` pieces
+
+    When the frame is sorted on its time column, boundaries are moved to the
+    start of a day so partitions hold whole days and their time buckets
+    barely overlap.
+    """
+    bounds = np.linspace(0, len(df), parts + 1).astype(int)
+    if time is not None and df[time].is_monotonic_increasing:
+        days = df[time].to_numpy()
+        starts = days[bounds[1:-1]].astype('datetime64[D]').astype(days.dtype)
+        bounds[1:-1] = np.searchsorted(days, starts)
+    bounds = np.unique(bounds)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def applies(rollups):
+    """Whether a dataset is large enough, and held in memory, to aggregate on the process pool"""
+    backend = rollups.backend
+    return isinstance(backend, InMemoryBackend) and backend.num_rows >= PARALLEL_MIN_ROWS and worker_count() > 1
+
+
+def map_partials(plan, rollups, columns):
+    """Yield (rows, partial aggregate) for every partition as workers finish them
+
+    Returns None when the columns cannot be shared; the caller then
+    aggregates in-process.
+    """
+    specs = shared_columns(rollups).specs(list(dict.fromkeys(columns + list(plan["filters"]))))
+    if specs is None:
+        return None
+    time = rollups.profile()["time"]
+    # A few partitions per worker keeps them all busy when partitions take uneven time
+    ranges = partitions(rollups.backend.df, worker_count() * 4, time)
+    pool = get_pool()
+    dataset = (rollups.name, rollups.version)
+    futures = [pool.submit(_partial, dataset, specs, plan, columns, start, stop) for start, stop in ranges]
+
+    def results():
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+    return results()
+
+
+# Worker side: segment name -> ((dataset name, version), segment) attached
+# by this process, oldest first, and the latest version seen of each dataset
+_attached = OrderedDict()
+_latest = {}
+
+
+def _close(segment):
+    try:
+        segment.close()
+    except BufferError:
+        # Still viewed by a frame; unmapped once that is collected
+        pass
+
+
+def _detach_superseded():
+    # Unlinked segments stay in memory while a worker maps them
+    for name in [name for name, ((dataset, version), _) in _attached.items() if version < _latest[dataset]]:
+        _close(_attached.pop(name)[1])
+
+
+def _attach(name, dataset):
+    entry = _attached.get(name)
+    if entry is None:
+        entry = _attached[name] = (dataset, shared_memory.SharedMemory(name=name))
+        while len(_attached) > MAX_ATTACHED:
+            _close(_attached.popitem(last=False)[1][1])
+    else:
+        _attached.move_to_end(name)
+    return entry[1]
+
+
+def _partial(dataset, specs, plan, columns, start, stop):
+    """Partial aggregate of rows [start, stop) of a dataset version, run in a worker process"""
+    from planner import partial_aggregate
+
+    name, version = dataset
+    if version > _latest.get(name, version - 1):
+        _latest[name] = version
+        _detach_superseded()
+    data = {}
+    for column, (segment, dtype, length, categories) in specs.items():
+        values = np.ndarray(length, dtype=np.dtype(dtype), buffer=_attach(segment, dataset).buf)[start:stop]
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, categories)
+        data[column] = values
+    chunk = pd.DataFrame(data, copy=False)
+    if plan["filters"]:
+        chunk = chunk[InMemoryBackend(chunk)._mask(plan["filters"]).to_numpy()]
+    result = len(chunk), partial_aggregate(chunk[columns], plan)
+    if version < _latest[name]:
+        # A late task of an old version: do not keep its segments mapped
+        del data, chunk, values
+        _detach_superseded()
+    return result
@@ -0,0 +1,574 @@
+import json
+
+import pandas as pd
+
+import parallel
+from dataset_engine import DELTA_AGGS, RollupCache
+from intents import normalize_token, tokenize
+from time_index import TimeIndex
+
+# Words for the sample schema; any other column is matched by its own name
+MEASURE_SYNONYMS = {
+    'Revenue': ['revenue', 'sales', 'income', 'earnings'],
+    'Units_Sold': ['units', 'quantity', 'volume'],
+    'Rating': ['rating', 'ratings', 'score', 'satisfaction'],
+}
+DIMENSION_SYNONYMS = {
+    'Product_Category': ['category', 'categories', 'product', 'products'],
+    'Customer_Type': ['customer', 'customers'],
+    'Region': ['region', 'regions', 'regional', 'location', 'geographic'],
+}
+AGG_WORDS = {
+    'average': 'mean', 'avg': 'mean', 'mean': 'mean',
+    'total': 'sum', 'sum': 'sum',
+    'count': 'size', 'orders': 'size', 'transactions': 'size', 'records': 'size',
+    'minimum': 'min', 'min': 'min',
+    'maximum': 'max', 'max': 'max',
+    'distinct': 'nunique', 'unique': 'nunique',
+    'median': 'median',
+}
+GRAIN_WORDS = {
+    'day': 'D', 'daily': 'D',
+    'week': 'W', 'weekly': 'W',
+    'month': 'M', 'monthly': 'M',
+    'quarter': 'Q', 'quarterly': 'Q',
+    'year': 'Y', 'yearly': 'Y', 'annual': 'Y',
+}
+# Ask for a time breakdown without naming a grain; monthly unless one is named
+TREND_WORDS = ['trend', 'time', 'over']
+GRAIN_LABELS = {'D': 'Daily', 'W': 'Weekly', 'M': 'Monthly', 'Q': 'Quarterly', 'Y': 'Yearly'}
+GRAIN_NAMES = {'D': 'day', 'W': 'week', 'M': 'month', 'Q': 'quarter', 'Y': 'year'}
+DESCENDING_WORDS = ['top', 'best', 'highest', 'most']
+ASCENDING_WORDS = ['bottom', 'worst', 'lowest', 'least']
+DEFAULT_AGG = {'Rating': 'mean'}
+# Dimensions with more distinct values than this are not scanned for filter values
+MAX_FILTER_VALUES = 1000
+# Date ranges, counted back from the last date in the dataset: "last quarter"
+# is the quarter before it, "last 3 months" the three months up to it
+RANGE_UNITS = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+PREVIOUS_WORDS = ['last', 'previous', 'past', 'prior']
+CURRENT_WORDS = ['this', 'current']
+MONTH_NAMES = ['january', 'february', 'march', 'april', 'may', 'june',
+               'july', 'august', 'september', 'october', 'november', 'december']
+QUARTER_NAMES = {'q1': 1, 'q2': 2, 'q3': 3, 'q4': 4}
+# Group key of a plan comparing date ranges ("Q3 vs Q2")
+PERIOD_KEY = 'Period'
+
+# Keyword tables keyed on normalized tokens, as produced by tokenize()
+AGG_TOKENS = {normalize_token(word): agg for word, agg in AGG_WORDS.items()}
+GRAIN_TOKENS = {normalize_token(word): grain for word, grain in GRAIN_WORDS.items()}
+TREND_TOKENS = {normalize_token(word) for word in TREND_WORDS}
+ORDER_TOKENS = {normalize_token(word): "desc" for word in DESCENDING_WORDS}
+ORDER_TOKENS.update({normalize_token(word): "asc" for word in ASCENDING_WORDS})
+UNIT_TOKENS = {normalize_token(word): unit for word, unit in RANGE_UNITS.items()}
+PREVIOUS_TOKENS = {normalize_token(word) for word in PREVIOUS_WORDS}
+CURRENT_TOKENS = {normalize_token(word) for word in CURRENT_WORDS}
+MONTH_TOKENS = {normalize_token(word): month for month, word in enumerate(MONTH_NAMES, 1)}
+
+
+def new_plan():
+    """Empty plan; unmentioned parts stay None and are filled by complete_plan"""
+    return {
+        "measures": None,
+        "agg": None,
+        "time": None,
+        "grain": None,
+        "dimensions": [],
+        "filters": {},
+        "periods": [],
+        "sort": None,
+        "limit": None,
+    }
+
+
+def period_range(first, last=None):
+    """Half-open date range covering periods `first` to `last`, as a filter value
+
+    Date range filters are dicts of ISO dates, {"start": ..., "end": ...},
+    where list filters hold dimension values.
+    """
+    last = first if last is None else last
+    return {"start": first.start_time.date().isoformat(), "end": (last + 1).start_time.date().isoformat()}
+
+
+def describe_range(date_range):
+    """Label of a date range: 'Q3 2024', 'July 2024', '2024' or '2024-07-01 to 2024-08-15'"""
+    start, end = pd.Timestamp(date_range["start"]), pd.Timestamp(date_range["end"])
+    for freq, label in (('Y', '%Y'), ('Q', 'Q%q %Y'), ('M', '%B %Y')):
+        period = pd.Period(start, freq)
+        if period.start_time == start and (period + 1).start_time == end:
+            return period.strftime(label)
+    return f"{start.date()} to {(end - pd.Timedelta(days=1)).date()}"
+
+
+def period_label(period):
+    """Label of one compared period of a plan: its date range filter"""
+    return describe_range(next(iter(period.values())))
+
+
+def parse_ranges(tokens, latest):
+    """Date ranges named in a question and the token positions they used
+
+    `latest` is the last date in the dataset: relative ranges count back
+    from it and a quarter or month without a year is its latest occurrence.
+    """
+    ranges, used = [], set()
+
+    def year_near(position):
+        for other in (position + 1, position - 1):
+            if 0 <= other < len(tokens) and other not in used and len(tokens[other]) == 4 and tokens[other].isdigit():
+                used.add(other)
+                return int(tokens[other])
+        return None
+
+    def latest_occurrence(period, per_year):
+        return period if period.start_time <= latest else period - per_year
+
+    for position, token in enumerate(tokens):
+        if position in used:
+            continue
+        if token in PREVIOUS_TOKENS or token in CURRENT_TOKENS:
+            count = None
+            unit_at = position + 1
+            if unit_at < len(tokens) and tokens[unit_at].isdigit():
+                count, unit_at = int(tokens[unit_at]), unit_at + 1
+            if unit_at >= len(tokens) or tokens[unit_at] not in UNIT_TOKENS:
+                continue
+            current = pd.Period(latest, UNIT_TOKENS[tokens[unit_at]])
+            if token in CURRENT_TOKENS:
+                ranges.append(period_range(current))
+            elif count:
+                ranges.append(period_range(current - (count - 1), current))
+            else:
+                ranges.append(period_range(current - 1))
+            used.update(range(position, unit_at + 1))
+        elif token == 'ytd' or tokens[position:position + 3] == ['year', 'to', 'date']:
+            ranges.append({"start": pd.Period(latest, 'Y').start_time.date().isoformat(),
+                           "end": (latest.normalize() + pd.Timedelta(days=1)).date().isoformat()})
+            used.update(range(position, position + (1 if token == 'ytd' else 3)))
+        elif token in QUARTER_NAMES:
+            used.add(position)
+            year = year_near(position)
+            quarter = pd.Period(year=year or latest.year, quarter=QUARTER_NAMES[token], freq='Q')
+            ranges.append(period_range(quarter if year else latest_occurrence(quarter, 4)))
+        elif token in MONTH_TOKENS:
+            year = year_near(position)
+            if token == 'may' and year is None:
+                continue
+            used.add(position)
+            month = pd.Period(year=year or latest.year, month=MONTH_TOKENS[token], freq='M')
+            ranges.append(period_range(month if year else latest_occurrence(month, 12)))
+
+    for position, token in enumerate(tokens):
+        if position not in used and len(token) == 4 and token.isdigit() and 1900 <= int(token) <= 2100:
+            used.add(position)
+            ranges.append(period_range(pd.Period(int(token), 'Y')))
+    return ranges, used
+
+
+def build_vocabulary(rollups):
+    """Map query tokens to columns and dimension values for one dataset version"""
+    profile = rollups.profile()
+    vocabulary = {"measures": {}, "dimensions": {}, "values": {}, "time": profile["time"]}
+    for column in profile["measures"] + profile["dimensions"]:
+        if profile["columns"][column]["role"] == 'measure':
+            target, synonyms = vocabulary["measures"], MEASURE_SYNONYMS.get(column)
+        else:
+            target, synonyms = vocabulary["dimensions"], DIMENSION_SYNONYMS.get(column)
+        for word in synonyms or column.split('_'):
+            for token in tokenize(word):
+                target.setdefault(token, column)
+
+    for column in profile["dimensions"]:
+        # The profile's distinct count avoids grouping high-cardinality columns
+        if profile["columns"][column]["distinct"] > MAX_FILTER_VALUES:
+            continue
+        for value in rollups.get(column, column, agg='size').index:
+            tokens = tuple(tokenize(str(value)))
+            if tokens:
+                vocabulary["values"].setdefault(tokens, (column, value))
+    return vocabulary
+
+
+def parse_plan(query, rollups):
+    """Extract measure, dimensions, filters, grain and ordering from a question"""
+    vocabulary = rollups.cached(("vocabulary",), lambda: build_vocabulary(rollups))
+    tokens = tokenize(query)
+    plan = new_plan()
+    measures, dimensions, counted = [], [], set()
+
+    # "last quarter by week": the range's words are not also read as a grain
+    ranges, used = [], set()
+    if vocabulary["time"]:
+        ranges, used = parse_ranges(tokens, rollups.profile()["columns"][vocabulary["time"]]["max"])
+
+    for position, token in enumerate(tokens):
+        if position in used:
+            continue
+        if token in vocabulary["measures"]:
+            measures.append(vocabulary["measures"][token])
+        if token in vocabulary["dimensions"]:
+            column = vocabulary["dimensions"][token]
+            # "distinct categories by region" counts categories per region
+            if position and (AGG_TOKENS.get(tokens[position - 1]) == 'nunique' or column in counted):
+                counted.add(column)
+                measures.append(column)
+            else:
+                dimensions.append(column)
+        if token in AGG_TOKENS:
+            plan["agg"] = AGG_TOKENS[token]
+        if token in GRAIN_TOKENS and vocabulary["time"]:
+            plan["time"], plan["grain"] = vocabulary["time"], GRAIN_TOKENS[token]
+        elif token in TREND_TOKENS and vocabulary["time"] and not plan["grain"]:
+            plan["time"], plan["grain"] = vocabulary["time"], 'M'
+        if token in ORDER_TOKENS:
+            plan["sort"] = ORDER_TOKENS[token]
+        elif token.isdigit() and position > 0 and tokens[position - 1] in ORDER_TOKENS:
+            plan["limit"] = int(token)
+
+    # Filter values may span several tokens ("New York")
+    padded = f" {' '.join(tokens)} "
+    for value_tokens, (column, value) in vocabulary["values"].items():
+        if f" {' '.join(value_tokens)} " in padded:
+            plan["filters"].setdefault(column, []).append(value)
+
+    if len(ranges) == 1:
+        plan["filters"][vocabulary["time"]] = ranges[0]
+    elif ranges:
+        # "Q3 vs Q2" compares totals (or dimensions) between the ranges
+        plan["periods"] = [{vocabulary["time"]: date_range} for date_range in ranges]
+        plan["time"] = plan["grain"] = None
+
+    if measures:
+        plan["measures"] = list(dict.fromkeys(measures))
+    # "new customers" filters on Customer_Type rather than grouping by it
+    plan["dimensions"] = [
+        column for column in dict.fromkeys(dimensions)
+        if len(plan["filters"].get(column, [])) != 1
+    ][:2]
+    return normalize_plan(plan, rollups)
+
+
+def normalize_plan(plan, rollups):
+    """Canonical form: sorted filter values, filters covering every value dropped"""
+    filters = {}
+    for column, values in sorted(plan["filters"].items()):
+        if isinstance(values, dict):
+            filters[column] = values
+            continue
+        all_values = rollups.get(column, column, agg='size').index
+        if len(set(values)) < len(all_values):
+            filters[column] = sorted(set(values), key=str)
+    plan["filters"] = filters
+    return plan
+
+
+def is_compatible(plan, defaults):
+    """Whether a parsed plan fits an intent that answers `defaults`
+
+    Only what the question names explicitly can conflict; filters, grain and
+    ordering always carry over.
+    """
+    if defaults is None:
+        return True
+    if plan.get("periods"):
+        return False
+    if plan["measures"] and plan["measures"] != defaults.get("measures"):
+        return False
+    if plan["agg"] and plan["agg"] != defaults.get("agg", "sum"):
+        return False
+    if plan["time"] and not defaults.get("time"):
+        return False
+    return not plan["dimensions"] or plan["dimensions"] == defaults.get("dimensions", [])
+
+
+def defaults_available(defaults, profile):
+    """Whether every column an intent's `defaults` answer from is in the dataset"""
+    if defaults is None:
+        return True
+    columns = defaults.get("measures", []) + defaults.get("dimensions", [])
+    if defaults.get("time"):
+        columns = columns + [defaults["time"]]
+    return all(column in profile["columns"] for column in columns)
+
+
+def complete_plan(plan, profile, defaults=None):
+    """Fill the parts the question left out from `defaults`, then the dataset's defaults
+
+    The fallback measure is the first numeric column in the `profile`
+    (see RollupCache.profile); datasets without one count records.
+    """
+    defaults = defaults or {}
+    plan = dict(plan)
+    for key in ("measures", "agg", "time", "grain", "sort", "limit"):
+        if plan[key] is None:
+            plan[key] = defaults.get(key)
+    if not plan["dimensions"]:
+        plan["dimensions"] = list(defaults.get("dimensions", []))
+    if not plan["measures"]:
+        plan["measures"] = (profile["measures"] or list(profile["columns"]))[:1]
+        if not profile["measures"]:
+            plan["agg"] = 'size'
+    if not plan["agg"]:
+        plan["agg"] = DEFAULT_AGG.get(plan["measures"][0], 'sum')
+    return plan
+
+
+def plan_key(plan):
+    """Cache key for the aggregate a plan computes (ordering applied afterwards)"""
+    keyed = {key: plan[key] for key in ("measures", "agg", "time", "grain", "dimensions", "filters")}
+    keyed["periods"] = plan.get("periods", [])
+    return json.dumps(keyed, sort_keys=True, default=str)
+
+
+def plan_keys(plan):
+    """Group-by columns of a plan: the compared period or time bucket first, then dimensions"""
+    return ([PERIOD_KEY] if plan.get("periods") else []) + ([plan["time"]] if plan["time"] else []) + plan["dimensions"]
+
+
+def time_index(rollups):
+    """Prefix-sum index over the dataset's time column (see time_index), None without one"""
+    profile = rollups.profile()
+    if profile["time"] is None:
+        return None
+    return rollups.cached(("time_index",), lambda: TimeIndex(rollups, profile["time"], profile["measures"]))
+
+
+def uses_time_index(plan, rollups):
+    """Whether a plan is a date-range total or trend answered from the time index"""
+    column = rollups.profile()["time"]
+    filters = plan["filters"]
+    if column is None or list(filters) != [column] or not isinstance(filters[column], dict):
+        return False
+    if plan["dimensions"] or plan.get("periods") or plan["time"] not in (None, column):
+        return False
+    return time_index(rollups).answers(plan["measures"], plan["agg"])
+
+
+def in_rollups(plan, rollups):
+    """Whether every measure of an unfiltered single-dimension plan is already in the shared rollups"""
+    keys = plan_keys(plan)
+    if plan["filters"] or len(keys) > 1:
+        return False
+    return all(
+        (keys[0] if keys else None, measure, plan["grain"] if plan["time"] else None, plan["agg"]) in rollups
+        for measure in plan["measures"]
+    )
+
+
+def answered_without_scan(plan, rollups):
+    """Whether a plan's result is already at hand: cached, in the shared rollups or in the time index"""
+    return in_rollups(plan, rollups) or ("plan", plan_key(plan)) in rollups or uses_time_index(plan, rollups)
+
+
+# Rows scanned per unit of plan cost
+COST_ROWS = 1_000_000
+
+
+def plan_cost(plan, rollups):
+    """Rough cost of running a plan: millions of rows to scan, 0 if answered without a scan
+
+    Distinct counts and medians count double: they keep values per group
+    rather than running totals. Only looks at what is already cached, so
+    pricing a plan never builds the time index or anything else.
+    """
+    if plan.get("periods"):
+        return sum(
+            plan_cost(dict(plan, periods=[], filters=dict(plan["filters"], **period)), rollups)
+            for period in plan["periods"]
+        )
+    if (("plan", plan_key(plan)) in rollups or in_rollups(plan, rollups)
+            or (("time_index",) in rollups and uses_time_index(plan, rollups))):
+        return 0.0
+    return rollups.backend.num_rows / COST_ROWS * (2 if plan["agg"] in ('nunique', 'median') else 1)
+
+
+def run_plan(plan, rollups):
+    """Aggregate frame for a completed plan, indexed by its group-by columns"""
+    def build():
+        keys = plan_keys(plan)
+        if plan.get("periods"):
+            # One sub-plan per compared range, each with the range as a filter
+            frames = [
+                run_plan(dict(plan, periods=[], filters=dict(plan["filters"], **period), sort=None, limit=None), rollups)
+                for period in plan["periods"]
+            ]
+            frame = pd.concat(frames, keys=[period_label(period) for period in plan["periods"]], names=[PERIOD_KEY])
+            return frame if plan["dimensions"] else frame.droplevel(-1)
+        if uses_time_index(plan, rollups):
+            # Two binary searches per bucket instead of a scan of the range
+            index, date_range = time_index(rollups), plan["filters"][rollups.profile()["time"]]
+            if plan["time"]:
+                frame = pd.DataFrame({
+                    measure: index.series(measure, plan["agg"], plan["grain"], date_range["start"], date_range["end"])
+                    for measure in plan["measures"]
+                })
+                frame.index.name = plan["time"]
+                return frame
+            return pd.DataFrame(
+                {measure: [index.total(measure, plan["agg"], date_range["start"], date_range["end"])]
+                 for measure in plan["measures"]},
+                index=pd.Index(['All'], name='Total'),
+            )
+        if plan["agg"] in MERGEABLE_AGGS and parallel.applies(rollups) and not in_rollups(plan, rollups):
+            # Large in-memory datasets: partial aggregates on every core, merged here
+            partials = parallel.map_partials(plan, rollups, list(dict.fromkeys(keys + plan["measures"])))
+            if partials is not None:
+                return finalize_partial(merge_partials([partial for _, partial in partials], plan), plan)
+        if not plan["filters"] and len(keys) <= 1:
+            # Reuse the shared single-dimension rollups
+            dimension = keys[0] if keys else None
+            data = {
+                measure: rollups.get(dimension, measure, plan["grain"] if plan["time"] else None, plan["agg"])
+                for measure in plan["measures"]
+            }
+            if dimension is None:
+                return pd.DataFrame(data, index=pd.Index(['All'], name='Total'))
+            frame = pd.DataFrame(data)
+            frame.index.name = dimension
+            return frame
+        return rollups.backend.run(plan)
+
+    frame = rollups.cached(("plan", plan_key(plan)), build)
+    if plan["sort"]:
+        frame = frame.sort_values(plan["measures"][0], ascending=plan["sort"] == "asc")
+    if plan["limit"]:
+        frame = frame.head(plan["limit"])
+    return frame
+
+
+# Aggregations whose per-chunk partials can be merged exactly
+MERGEABLE_AGGS = ('sum', 'size', 'count', 'min', 'max', 'mean', 'nunique')
+
+
+def partial_aggregate(chunk, plan):
+    """Mergeable partial aggregate of one chunk of rows for a completed plan
+
+    Means are carried as sum and count columns and distinct counts as the
+    arrays of distinct values of each group until finalize_partial.
+    """
+    keys = [chunk[column] for column in plan["dimensions"]]
+    if plan["time"]:
+        keys.insert(0, chunk[plan["time"]].dt.to_period(plan["grain"]))
+    measures, agg = plan["measures"], plan["agg"]
+    if not keys:
+        # A constant key keeps the whole-table case on the same path
+        keys = [pd.Series('All', index=chunk.index, name='Total')]
+    grouped = chunk.groupby(keys, observed=True)
+    if agg == 'size':
+        sizes = grouped.size()
+        return pd.DataFrame({measure: sizes for measure in measures})
+    if agg == 'mean':
+        sums = grouped[measures].sum().add_suffix('__sum')
+        counts = grouped[measures].count().add_suffix('__count')
+        return pd.concat([sums, counts], axis=1)
+    if agg == 'nunique':
+        return pd.DataFrame({measure: grouped[measure].unique() for measure in measures})
+    return grouped[measures].agg(agg)
+
+
+def merge_partials(partials, plan):
+    """Combine partial aggregates of disjoint chunks"""
+    combined = pd.concat(partials)
+    levels = list(range(combined.index.nlevels))
+    if plan["agg"] == 'nunique':
+        # A value seen in two chunks counts once: union the distinct values of each group
+        return pd.DataFrame({
+            measure: combined[measure].explode().dropna().groupby(level=levels, observed=True).unique()
+            for measure in plan["measures"]
+        }).reindex(combined.index.unique())
+    how = {'size': 'sum', 'count': 'sum', 'mean': 'sum'}.get(plan["agg"], plan["agg"])
+    return combined.groupby(level=levels, observed=True).agg(how)
+
+
+def finalize_partial(partial, plan):
+    """Turn a merged partial aggregate into the plan's result frame"""
+    if plan["agg"] == 'nunique':
+        # Groups whose values were all missing have no array
+        partial = partial.map(lambda values: len(values) if hasattr(values, '__len__') else 0).astype('int64')
+    if plan["agg"] == 'mean':
+        partial = pd.DataFrame({
+            measure: partial[f"{measure}__sum"] / partial[f"{measure}__count"]
+            for measure in plan["measures"]
+        })
+    return partial.sort_index()
+
+
+def scan_plan(plan, rollups, chunk_rows=250_000):
+    """Run a plan chunk by chunk, yielding (rows_done, rows_total, running result)
+
+    The final result is stored in the rollup cache so run_plan reuses it.
+    Only plans whose aggregation is in MERGEABLE_AGGS can be scanned. Large
+    in-memory datasets are scanned on the process pool, partitions arriving
+    in the order workers finish them.
+    """
+    columns = list(dict.fromkeys(plan_keys(plan) + plan["measures"]))
+    merged, done = None, 0
+    total = rollups.backend.count_rows(plan["filters"])
+    partials = parallel.map_partials(plan, rollups, columns) if parallel.applies(rollups) else None
+    if partials is None:
+        partials = (
+            (len(chunk), partial_aggregate(chunk, plan))
+            for chunk in rollups.backend.iter_chunks(columns, plan["filters"], chunk_rows)
+        )
+    for rows, partial in partials:
+        merged = partial if merged is None else merge_partials([merged, partial], plan)
+        done += rows
+        yield done, total, finalize_partial(merged, plan)
+    if merged is not None:
+        rollups.cached(("plan", plan_key(plan)), lambda: finalize_partial(merged, plan))
+
+
+def extend_plan(key, frame, batch):
+    """Update a cached plan result with the rows of an appended batch
+
+    Used by RollupCache.extend; means are dropped and recomputed on demand.
+    """
+    plan = dict(json.loads(key[1]), sort=None, limit=None)
+    # Comparisons are rebuilt from their per-range sub-plans, which are updated
+    if plan["agg"] not in DELTA_AGGS or plan["periods"]:
+        return None
+    return finalize_partial(merge_partials([frame, batch.run(plan)], plan), plan)
+
+
+RollupCache.updaters["plan"] = extend_plan
+
+
+def plan_code(plan):
+    """Equivalent pandas code for a completed plan, shown by "Show Python code\""""
+    if plan.get("periods"):
+        # One expression per compared range
+        lines = [
+            f"    {period_label(period)!r}: {plan_code(dict(plan, periods=[], filters=dict(plan['filters'], **period)))},"
+            for period in plan["periods"]
+        ]
+        return "{\n" + "\n".join(lines) + "\n}"
+    code = "df"
+    conditions = []
+    for column, values in plan["filters"].items():
+        if isinstance(values, dict):
+            conditions.append(f"(df['{column}'] >= '{values['start']}') & (df['{column}'] < '{values['end']}')")
+        elif len(values) == 1:
+            conditions.append(f"(df['{column}'] == {values[0]!r})")
+        else:
+            conditions.append(f"df['{column}'].isin({values!r})")
+    if conditions:
+        code += f"[{' & '.join(conditions)}]"
+
+    keys = [f"'{column}'" for column in plan["dimensions"]]
+    if plan["time"]:
+        keys.insert(0, f"df['{plan['time']}'].dt.to_period('{plan['grain']}')")
+    measures = plan["measures"]
+    selection = f"['{measures[0]}']" if len(measures) == 1 else f"[{measures!r}]"
+    if keys:
+        by = keys[0] if len(keys) == 1 else f"[{', '.join(keys)}]"
+        code += f".groupby({by}){selection}"
+    else:
+        code += selection
+    code += ".size()" if plan["agg"] == 'size' else f".{plan['agg']}()"
+    if plan["sort"]:
+        by = "" if len(measures) == 1 or not keys else f"'{measures[0]}', "
+        code += f".sort_values({by}ascending={plan['sort'] == 'asc'})"
+    if plan["limit"]:
+        code += f".head({plan['limit']})"
+    return code
@@ -1,10 +1,23 @@
+import time
+
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 import io
 import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Only light modules are imported up front so the login screen renders fast;
+# pandas, Plotly and the analytics stack load in the background after login
+import metrics
+from admission import RateLimiter
+from execution import QueryExecutor
+from history import SQLiteStore
+
+metrics.record_startup("script_imports", time.perf_counter() - SCRIPT_STARTED)
 
 # Page config
 st.set_page_config(
@@ -175,36 +188,244 @@ if 'authenticated' not in st.session_state:
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 
-def create_sample_dataset():
-    """Create a sample dataset - replace this with your actual data loading logic"""
-    import numpy as np
-    
-    # Sample e-commerce data
-    np.random.seed(42)
-    dates = pd.date_range('2024-01-01', '2024-12-31', freq='D')
-    
-    data = {
-        'Date': np.random.choice(dates, 1000),
-        'Product_Category': np.random.choice(['Electronics', 'Clothing', 'Books', 'Home', 'Sports'], 1000),
-        'Revenue': np.random.normal(1000, 300, 1000).round(2),
-        'Units_Sold': np.random.poisson(5, 1000),
-        'Customer_Type': np.random.choice(['New', 'Returning'], 1000, p=[0.3, 0.7]),
-        'Region': np.random.choice(['North', 'South', 'East', 'West'], 1000),
-        'Rating': np.random.choice([1, 2, 3, 4, 5], 1000, p=[0.05, 0.1, 0.2, 0.35, 0.3])
-    }
-    
-    df = pd.DataFrame(data)
-    df['Revenue'] = df['Revenue'].abs()  # Ensure positive revenue
-    return df.sort_values('Date').reset_index(drop=True)
+# Transcript rendering limits: only the most recent messages are sent to the
+# browser, and only the latest charts are rendered live
+HISTORY_PAGE_SIZE = 20
+MAX_LIVE_FIGURES = 3
+
+# Older messages are evicted from the session (they stay in the conversation
+# store) once it holds more than this many
+MAX_MESSAGES_IN_MEMORY = 200
+
+if 'history_shown' not in st.session_state:
+    st.session_state.history_shown = HISTORY_PAGE_SIZE
 
-if 'dataset' not in st.session_state:
+# Whether the user's stored history has been loaded into this session
+if 'history_loaded' not in st.session_state:
+    st.session_state.history_loaded = False
+
+# Background job computing the answer to the latest question, if any
+if 'pending_job' not in st.session_state:
+    st.session_state.pending_job = None
+
+# Datasets this session has started loading for restored history
+if 'preloading' not in st.session_state:
+    st.session_state.preloading = set()
+
+def build_dataset_registry():
+    """Shared dataset registry - one per server process, reused by every session"""
+    started = time.perf_counter()
+    from analytics import invalidate_dataset
+    from dataset_engine import DatasetRegistry, create_sample_dataset
+    metrics.record_startup("analytics_imports", time.perf_counter() - started)
+    
+    registry = DatasetRegistry()
+    # Cached answers are dropped as soon as a dataset is reloaded
+    registry.on_reload(invalidate_dataset)
     # Load your backend dataset here
     # For demo purposes, I'll create sample data
-    st.session_state.dataset = create_sample_dataset()
+    registry.register("sample", create_sample_dataset)
+    # Every CSV/Parquet file in this directory is offered in the dataset switcher
+    data_dir = os.environ.get("COGNICHAT_DATA_DIR")
+    if data_dir:
+        registry.register_directory(data_dir)
+    # A CSV/Parquet file can be served by default; it is reloaded when the file changes
+    path = os.environ.get("COGNICHAT_DATASET")
+    if path:
+        registry.register_file(path)
+    # New rows dropped into this directory are appended to the default dataset
+    ingest_dir = os.environ.get("COGNICHAT_INGEST_DIR")
+    if ingest_dir:
+        registry.watch(registry.names()[-1], ingest_dir)
+    return registry
+
+def warm_up(registry_future):
+    """Load the default dataset and answer a first question to prime the caches"""
+    from analytics import process_query
+    from planner import time_index
+    
+    registry = registry_future.result()
+    name = registry.names()[-1]
+    started = time.perf_counter()
+    rollups = registry.rollups(name)
+    rollups.profile()
+    metrics.record_startup("dataset", time.perf_counter() - started)
+    
+    # Builds the planner vocabulary and time index so the first real question is not the slow one
+    started = time.perf_counter()
+    process_query("summary", registry.backend(name), rollups=rollups)
+    time_index(rollups)
+    metrics.record_startup("first_query", time.perf_counter() - started)
+
+@st.cache_resource
+def start_warm_up():
+    """Build the registry and warm its default dataset on a background thread, once per process
+
+    Called at login, so the login screen itself never pays for pandas, Plotly
+    or the dataset. Returns the futures of both steps; a failed warm-up stays
+    cached until it is cleared (see dataset_loading).
+    """
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warm-up")
+    registry_future = pool.submit(build_dataset_registry)
+    warm_up_future = pool.submit(warm_up, registry_future)
+    pool.shutdown(wait=False)
+    return registry_future, warm_up_future
+
+def get_dataset_registry():
+    """The shared registry, waiting for the background warm-up to create it"""
+    registry_future, _ = start_warm_up()
+    return registry_future.result()
+
+def registry_ready():
+    """Whether the warm-up has created the registry"""
+    registry_future, _ = start_warm_up()
+    return registry_future.done() and registry_future.exception() is None
+
+def warm_up_error():
+    """The exception that stopped the warm-up, or None while it runs or once it succeeded"""
+    for future in start_warm_up():
+        if future.done() and future.exception() is not None:
+            return future.exception()
+    return None
+
+@st.cache_resource
+def get_dataset_loader():
+    """Background pool loading datasets picked in the switcher"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="dataset-load")
+
+def preload_dataset(name):
+    """Load a dataset and profile it off the script thread"""
+    registry = get_dataset_registry()
+    get_dataset_loader().submit(lambda: registry.rollups(name).profile())
+
+def dataset_ready(name):
+    """Whether the dataset can be shown without waiting for the warm-up"""
+    return registry_ready() and name is not None and get_dataset_registry().is_loaded(name)
+
+@st.cache_resource
+def get_query_executor():
+    """Shared worker pool that answers questions off the script thread"""
+    executor = QueryExecutor(max_workers=4, per_user_limit=1, timeout=30.0)
+    for key, help in (("queued", "Questions waiting for a worker"),
+                      ("delayed", "Queued questions held back by rate limiting"),
+                      ("running", "Questions being answered"),
+                      ("heavy_running", "Expensive questions being answered"),
+                      ("shed", "Expensive questions turned away while the queue was full")):
+        metrics.gauge(f"cognichat_executor_{key}", lambda key=key: executor.stats()[key], help)
+    return executor
+
+@st.cache_resource
+def get_rate_limiter():
+    """Per-user question budgets, shared by all of a user's sessions"""
+    limiter = RateLimiter()
+    metrics.gauge("cognichat_rate_limited", lambda: limiter.stats()["rejected"],
+                  "Questions turned away for exceeding a user's budget")
+    return limiter
+
+def admit_question(prompt, max_rows, approximate):
+    """Queue a question for answering, or explain in the chat why it was not
+
+    Questions are charged their estimated cost against the user's budget;
+    over budget they start later or, past the limit, are refused. Expensive
+    ones are also refused while the server's queue is full.
+    """
+    user = st.session_state.user_info['username']
+    cost = 1.0
+    if dataset_ready(st.session_state.dataset_name):
+        from analytics import question_cost
+        cost = question_cost(prompt, get_dataset_registry().rollups(st.session_state.dataset_name), max_rows)
+    
+    limiter = get_rate_limiter()
+    admitted, wait = limiter.reserve(user, cost)
+    if not admitted:
+        add_message({
+            "role": "assistant",
+            "content": f"🚦 You're asking faster than I can answer. Please try again in {wait:.0f}s."
+        })
+        return
+    job = get_query_executor().submit(
+        user, answer_question, start_warm_up()[0], st.session_state.dataset_name, prompt, max_rows, approximate,
+        cost=cost, delay=wait,
+    )
+    if job is None:
+        limiter.refund(user, cost)
+        add_message({
+            "role": "assistant",
+            "content": "🚦 The server is busy with other large analyses right now. Please try again in a minute, "
+                       "or narrow the question down, e.g. to one region or a date range."
+        })
+        return
+    st.session_state.pending_job = job
+
+@st.cache_resource
+def get_metrics_server():
+    """Prometheus /metrics endpoint, started once per process when COGNICHAT_METRICS_PORT is set"""
+    port = os.environ.get("COGNICHAT_METRICS_PORT")
+    host = os.environ.get("COGNICHAT_METRICS_HOST", "127.0.0.1")
+    return metrics.serve(int(port), host) if port else None
+
+get_metrics_server()
+
+@st.cache_resource
+def get_conversation_store():
+    """Chat history shared by every session, so users get it back after reconnecting"""
+    return SQLiteStore(os.environ.get("COGNICHAT_HISTORY_DB", "chat_history.sqlite3"))
+
+def add_message(message):
+    """Append a message to the transcript and the conversation store"""
+    message = dict(message, id=get_conversation_store().append(st.session_state.user_info['username'], message))
+    messages = st.session_state.messages
+    messages.append(message)
+    if len(messages) > max(MAX_MESSAGES_IN_MEMORY, st.session_state.history_shown):
+        # Oldest turns can be loaded back from the store on demand
+        del messages[:len(messages) - MAX_MESSAGES_IN_MEMORY]
+        st.session_state.history_shown = min(st.session_state.history_shown, len(messages))
+
+def load_earlier_messages():
+    """Pull the previous page of history back from the store"""
+    messages = st.session_state.messages
+    before = messages[0].get("id") if messages else None
+    earlier = get_conversation_store().load(st.session_state.user_info['username'], before, HISTORY_PAGE_SIZE)
+    st.session_state.messages = earlier + messages
+
+def cancel_pending_query():
+    """Drop the session's in-flight question, e.g. when a new one is asked
+
+    An approximate answer already shown is kept as the answer.
+    """
+    if st.session_state.pending_job is not None:
+        from analytics import settle_estimate
+        
+        executor = get_query_executor()
+        job = executor.poll(st.session_state.pending_job)
+        executor.cancel(st.session_state.pending_job)
+        if job is not None and (job["partial"] or {}).get("stage") == "approximate":
+            add_message(settle_estimate(job["partial"]))
+        st.session_state.pending_job = None
+
+def answer_question(registry_future, name, prompt, max_rows, approximate=False):
+    """Stream the answer to `prompt`; waits for the warm-up if it is still running
+
+    `name` is None when the question was asked before the registry was
+    ready, meaning the default dataset.
+    """
+    from analytics import stream_query
+    
+    registry = registry_future.result()
+    name = name or registry.names()[-1]
+    yield from stream_query(prompt, registry.backend(name), max_rows, registry.rollups(name), approximate)
+
+# Chosen after login so the login screen never waits for the registry
+if 'dataset_name' not in st.session_state:
+    st.session_state.dataset_name = None
 
 if 'user_info' not in st.session_state:
     st.session_state.user_info = None
 
+# Identifies the session in the admin performance panel
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
+
 
 
 def authenticate_user(username, password):
@@ -218,6 +439,9 @@ def authenticate_user(username, password):
     
     return username in valid_users and valid_users[username] == password
 
+# Users who can see the performance panel
+ADMIN_USERS = {"admin"}
+
 def login_screen():
     """Display login form"""
     
@@ -244,6 +468,7 @@ def login_screen():
                 if authenticate_user(username, password):
                     st.session_state.authenticated = True
                     st.session_state.user_info = {"username": username}
+                    start_warm_up()
                     st.success("✅ Login successful!")
                     st.rerun()
                 else:
@@ -260,9 +485,212 @@ def login_screen():
         </div>
         """, unsafe_allow_html=True)
 
+def render_table(result, rollups, index):
+    """Page through a result's table; only the visible page is sent to the browser"""
+    from analytics import parse_table_filter, table_columns, table_page
+    
+    page_size = st.session_state.get("max_rows", 10)
+    columns = table_columns(result, rollups)
+    col_sort, col_order, col_filter, col_page = st.columns([2, 1, 3, 1])
+    sort = col_sort.selectbox("Sort by", [None] + list(columns), format_func=lambda col: "—" if col is None else col,
+                              key=f"sort_{index}")
+    descending = col_order.toggle("Descending", key=f"desc_{index}")
+    text = col_filter.text_input("Filter", placeholder="e.g. Region = North, South", key=f"filter_{index}")
+    page = col_page.number_input("Page", min_value=1, value=1, step=1, key=f"page_{index}")
+    
+    filters, error = parse_table_filter(text, columns)
+    if error:
+        st.caption(f"⚠️ {error}")
+    rows, total = table_page(result, rollups, page - 1, page_size, sort, descending, filters)
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        page = pages
+        rows, total = table_page(result, rollups, page - 1, page_size, sort, descending, filters)
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    first = (page - 1) * page_size
+    st.caption(f"Rows {min(first + 1, total):,}–{min(first + page_size, total):,} of {total:,} · page {page} of {pages:,}")
+
+def render_message(message, index, show_code, live=True):
+    """Render one chat message; collapsed turns only render their chart when expanded"""
+    if message["role"] == "user":
+        st.markdown(f"""
+        <div class="user-message">
+            {message["content"]}
+        </div>
+        """, unsafe_allow_html=True)
+        return
+    
+    st.markdown(f"""
+    <div class="assistant-message">
+        {message["content"]}
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Display any charts or data, built on demand from the result descriptor
+    result = message.get("result")
+    if result and not live:
+        live = st.toggle("📊 Show chart and data", key=f"expand_{index}")
+    if result and live and not registry_ready():
+        # Reloaded from history before the warm-up finished: never wait for it here
+        st.caption("⏳ The chart and data will appear once the dataset has loaded.")
+        live = False
+    if result and live and result["dataset"] not in get_dataset_registry().names():
+        # Reloaded from history, but the dataset is no longer served
+        st.caption(f"ℹ️ The dataset '{result['dataset']}' is no longer available.")
+        live = False
+    if result and live and not dataset_ready(result["dataset"]):
+        # Reloaded from history for a dataset nobody has loaded yet
+        if result["dataset"] not in st.session_state.preloading:
+            st.session_state.preloading.add(result["dataset"])
+            preload_dataset(result["dataset"])
+        st.caption("⏳ The chart and data will appear once the dataset has loaded.")
+        live = False
+    if result and live:
+        from analytics import result_figure
+        
+        rollups = get_dataset_registry().rollups(result["dataset"])
+        if rollups.version != result["version"]:
+            st.caption("ℹ️ The dataset has been updated since this answer - showing current data.")
+        # A streamed answer at the "table" stage has no chart yet; an approximate one has
+        fig = result_figure(result, rollups) if message.get("stage") in (None, "approximate") else None
+        with metrics.stage("serialize"):
+            if fig is not None:
+                st.plotly_chart(fig, use_container_width=True, key=f"chart_{index}")
+            render_table(result, rollups, index)
+    if "code" in message and show_code:
+        st.code(message["code"], language="python")
+
+@st.fragment(run_every=0.5)
+def pending_response(show_code):
+    """Poll the background job for the latest question, showing partial answers as they stream in"""
+    executor = get_query_executor()
+    job = executor.poll(st.session_state.pending_job)
+    
+    if job is not None and job["status"] in ("queued", "running"):
+        if job["partial"] is not None:
+            render_message(job["partial"], "pending", show_code)
+        elif job["status"] == "queued" and job["starts_in"] > 0:
+            st.markdown(f"""
+            <div class="assistant-message">
+                🚦 You're asking quickly, so this question starts in {job["starts_in"]:.0f}s...
+            </div>
+            """, unsafe_allow_html=True)
+        elif job["status"] == "queued" and job["ahead"]:
+            st.markdown(f"""
+            <div class="assistant-message">
+                ⏳ Waiting for a free worker ({job["ahead"]} question{"s" if job["ahead"] > 1 else ""} ahead)...
+            </div>
+            """, unsafe_allow_html=True)
+        else:
+            st.markdown("""
+            <div class="assistant-message">
+                🤔 Analyzing your data...
+            </div>
+            """, unsafe_allow_html=True)
+        if st.button("⏹️ Cancel"):
+            cancel_pending_query()
+            st.rerun()
+        return
+    
+    if job is not None and job["status"] == "done":
+        add_message(job["result"])
+    elif job is not None and job["status"] == "timed_out" and (job["partial"] or {}).get("stage") == "approximate":
+        # The exact answer did not arrive in time; the estimate stands
+        from analytics import settle_estimate
+        
+        add_message(settle_estimate(job["partial"]))
+    elif job is not None and job["status"] == "timed_out":
+        add_message({
+            "role": "assistant",
+            "content": f"⏱️ This analysis took longer than {executor.timeout:.0f}s and was stopped.\n\nTry narrowing it down, e.g. to one region or product category."
+        })
+    elif job is not None and job["status"] == "failed":
+        add_message({
+            "role": "assistant",
+            "content": f"❌ I encountered an error: {job['error']}"
+        })
+    st.session_state.pending_job = None
+    st.rerun(scope="app")
+
+@st.fragment(run_every=2)
+def performance_panel():
+    """Live stage latencies, cache hit rates and session memory (admin only)"""
+    if not metrics.enabled():
+        st.caption("Metrics are off; turn them on to start collecting.")
+        return
+    
+    import pandas as pd
+    from analytics import built_results, responses
+    
+    rows = []
+    for (name, labels), histogram in sorted(metrics.histograms().items()):
+        rows.append({
+            "stage": " ".join([name] + [value for _, value in labels]),
+            "count": histogram.count,
+            "mean ms": round(1000 * histogram.sum / histogram.count, 1),
+            "p50 ms": 1000 * histogram.quantile(0.5),
+            "p95 ms": 1000 * histogram.quantile(0.95),
+            "p99 ms": 1000 * histogram.quantile(0.99),
+        })
+    if not rows:
+        st.caption("No questions answered yet.")
+    else:
+        st.markdown("**⏱️ Stage latency**")
+        st.dataframe(pd.DataFrame(rows).set_index("stage"), use_container_width=True)
+        st.caption(f"Latencies over {metrics.BUCKETS[-1]:g} s are counted as {1000 * metrics.BUCKETS[-1]:g} ms.")
+        stage = st.selectbox("Histogram", [row["stage"] for row in rows])
+        histogram = next(h for (name, labels), h in sorted(metrics.histograms().items())
+                         if " ".join([name] + [value for _, value in labels]) == stage)
+        buckets = [f"≤{1000 * bound:g} ms" for bound in metrics.BUCKETS] + ["slower"]
+        st.bar_chart(pd.Series(histogram.counts, index=pd.Index(buckets, name="latency"), name="questions"))
+    
+    st.markdown("**🗄️ Caches**")
+    st.dataframe(pd.DataFrame({
+        "responses": responses.stats(),
+        "results": built_results.stats(),
+    }).T[["hit_rate", "hits", "misses", "entries", "bytes", "evictions"]], use_container_width=True)
+    
+    st.markdown("**🚦 Admission**")
+    st.dataframe(pd.Series({**get_query_executor().stats(), **get_rate_limiter().stats()}, name="questions"),
+                 use_container_width=True)
+    
+    st.markdown("**🚀 Startup**")
+    st.dataframe(pd.Series(metrics.startup(), name="seconds").rename_axis("phase"), use_container_width=True)
+    
+    st.markdown("**👥 Session memory**")
+    sessions = metrics.sessions()
+    st.dataframe(pd.Series(sessions, name="bytes").rename_axis("session").sort_values(ascending=False),
+                 use_container_width=True)
+    st.download_button("⬇️ Prometheus metrics", metrics.render_prometheus(), file_name="metrics.prom")
+
+@st.fragment(run_every=1)
+def dataset_loading():
+    """Placeholder shown while the background warm-up loads the dataset, or why it failed"""
+    error = warm_up_error()
+    if error is not None:
+        st.error(f"❌ Could not load the dataset: {error}")
+        if st.button("🔄 Retry"):
+            # The failed warm-up is cached for every session; drop it and start over
+            start_warm_up.clear()
+            start_warm_up()
+            st.rerun(scope="app")
+        return
+    if registry_ready():
+        if st.session_state.dataset_name is None:
+            st.session_state.dataset_name = get_dataset_registry().names()[-1]
+        if dataset_ready(st.session_state.dataset_name):
+            st.rerun(scope="app")
+    st.info("⏳ Loading dataset...")
+
 def chat_interface():
     """Main chat interface"""
     
+    # Pick up where the user left off: only the latest page is loaded, older
+    # pages come from the store when asked for
+    if not st.session_state.history_loaded:
+        st.session_state.messages = get_conversation_store().load(st.session_state.user_info['username'], limit=HISTORY_PAGE_SIZE)
+        st.session_state.history_loaded = True
+    
     # Sidebar
     with st.sidebar:
         st.markdown("### 🧠 CogniChat")
@@ -271,47 +699,87 @@ def chat_interface():
         
         # Dataset info
         st.markdown("#### 📊 Current Dataset")
-        df = st.session_state.dataset
-        st.info(f"**Rows:** {df.shape[0]:,}\n\n**Columns:** {df.shape[1]}")
+        if registry_ready() and st.session_state.dataset_name is not None:
+            # Switching only changes which dataset new questions go to; loaded
+            # datasets stay in the shared registry
+            names = get_dataset_registry().names()
+            choice = st.selectbox("Dataset", names, index=names.index(st.session_state.dataset_name),
+                                  key="dataset_choice")
+            if choice != st.session_state.dataset_name:
+                st.session_state.dataset_name = choice
+                if not dataset_ready(choice):
+                    preload_dataset(choice)
+        if not dataset_ready(st.session_state.dataset_name):
+            dataset_loading()
+        else:
+            registry = get_dataset_registry()
+            # Schema and statistics are profiled once per dataset version
+            profile = registry.rollups(st.session_state.dataset_name).profile()
+            memory = registry.memory_report(st.session_state.dataset_name)
+            if memory is None:
+                memory_str = "memory-mapped from disk"
+            else:
+                memory_str = f"{memory['memory_before'] / 1024:,.1f} KB → {memory['memory_after'] / 1024:,.1f} KB"
+            st.info(
+                f"**Rows:** {profile['rows']:,}\n\n**Columns:** {len(profile['columns'])}\n\n"
+                f"**Memory:** {memory_str}"
+            )
         
-        # Show column info
-        with st.expander("📋 View Columns"):
-            for col in df.columns:
-                dtype_str = str(df[col].dtype)
-                if dtype_str.startswith('int') or dtype_str.startswith('float'):
-                    icon = "🔢"
-                elif dtype_str == 'object':
-                    icon = "📝"
-                elif 'datetime' in dtype_str:
-                    icon = "📅"
-                else:
-                    icon = "❓"
-                st.write(f"{icon} {col}")
+            # Show column info
+            with st.expander("📋 View Columns"):
+                for col, stats in profile["columns"].items():
+                    if stats["role"] == 'measure':
+                        st.write(f"🔢 {col} · {stats['min']:,g} to {stats['max']:,g}")
+                    elif stats["role"] == 'time':
+                        st.write(f"📅 {col} · {stats['min']:%Y-%m-%d} to {stats['max']:%Y-%m-%d}")
+                    else:
+                        icon = "🏷️" if stats["dtype"] == 'category' else "📝"
+                        st.write(f"{icon} {col} · {stats['distinct']:,} values")
         
         st.markdown("---")
         
         # Chat History Management
         st.markdown("#### 💬 Chat")
         if st.button("🗑️ Clear Chat History"):
+            cancel_pending_query()
+            get_conversation_store().clear(st.session_state.user_info['username'])
             st.session_state.messages = []
+            st.session_state.history_shown = HISTORY_PAGE_SIZE
             st.rerun()
         
-        st.markdown(f"Messages: {len(st.session_state.messages)}")
+        st.markdown(f"Messages: {get_conversation_store().count(st.session_state.user_info['username'])}")
         
         st.markdown("---")
         
         # Settings
         st.markdown("#### ⚙️ Settings")
         show_code = st.checkbox("Show Python code", value=False)
-        max_rows = st.slider("Max rows to display", 5, 50, 10)
+        approximate = st.toggle(
+            "Approximate answers", key="approximate",
+            help="Answer large datasets from a sample first, with 95% confidence intervals, while the exact answer is computed",
+        )
+        max_rows = st.slider("Rows per page", 5, 200, 10, key="max_rows")
         
         st.markdown("---")
         
+        # Performance panel
+        if st.session_state.user_info['username'] in ADMIN_USERS:
+            with st.expander("📈 Performance"):
+                collect = st.toggle("Collect metrics", value=metrics.enabled())
+                if collect != metrics.enabled():
+                    metrics.set_enabled(collect)
+                performance_panel()
+            st.markdown("---")
+        
         # Logout
         if st.button("🚪 Logout"):
+            cancel_pending_query()
             st.session_state.authenticated = False
             st.session_state.user_info = None
+            # History stays in the store and is reloaded at the next login
             st.session_state.messages = []
+            st.session_state.history_shown = HISTORY_PAGE_SIZE
+            st.session_state.history_loaded = False
             st.rerun()
 
     # Main chat area
@@ -352,237 +820,54 @@ def chat_interface():
             </div>
             """, unsafe_allow_html=True)
     
-    # Display chat messages
-    for message in st.session_state.messages:
-        if message["role"] == "user":
-            st.markdown(f"""
-            <div class="user-message">
-                {message["content"]}
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-            <div class="assistant-message">
-                {message["content"]}
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Display any charts or data
-            if "chart" in message:
-                st.plotly_chart(message["chart"], use_container_width=True)
-            if "dataframe" in message:
-                st.dataframe(message["dataframe"], use_container_width=True)
-            if "code" in message and show_code:
-                st.code(message["code"], language="python")
+    # Display chat messages - a page of recent history, older pages on demand
+    messages = st.session_state.messages
+    start = max(0, len(messages) - st.session_state.history_shown)
+    stored = get_conversation_store().count(st.session_state.user_info['username'], messages[0].get("id")) if messages else 0
+    if start + stored > 0:
+        if st.button(f"⬆️ Show earlier messages ({start + stored} hidden)"):
+            if start < HISTORY_PAGE_SIZE:
+                load_earlier_messages()
+            st.session_state.history_shown += HISTORY_PAGE_SIZE
+            st.rerun()
+    
+    # Charts and tables of older turns stay collapsed until expanded
+    live_from = len(messages)
+    live_figures = 0
+    while live_from > start and live_figures < MAX_LIVE_FIGURES:
+        live_from -= 1
+        if (messages[live_from].get("result") or {}).get("chart"):
+            live_figures += 1
+    
+    with metrics.stage("render"):
+        for index in range(start, len(messages)):
+            # Keyed on the stored id so widget state survives eviction and reloads
+            render_message(messages[index], messages[index].get("id", index), show_code, live=index >= live_from)
+    if metrics.enabled():
+        from analytics import estimate_size
+        # Labelled by session id only: the metrics must not say who is logged in
+        metrics.track_session(st.session_state.session_id, estimate_size(messages))
+    
+    # Answer for the latest question, computed in the background
+    if st.session_state.pending_job is not None:
+        pending_response(show_code)
     
     # Chat input
     if prompt := st.chat_input("Ask me anything about your data..."):
+        # A new question supersedes one that is still being answered
+        cancel_pending_query()
+        
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        add_message({"role": "user", "content": prompt})
         
-        # Generate response
-        with st.spinner("🤔 Analyzing your data..."):
-            response = process_query(prompt, st.session_state.dataset, max_rows)
-            st.session_state.messages.append(response)
+        # Generate response off the script thread, if admitted
+        admit_question(prompt, max_rows, approximate)
         
         st.rerun()
 
-def process_query(query, df, max_rows=20):
-    """Process natural language query and return response with visualizations"""
-    
-    query_lower = query.lower()
-    
-    try:
-        # Revenue analysis
-        if any(word in query_lower for word in ['revenue', 'sales', 'income', 'earnings']):
-            if 'trend' in query_lower or 'time' in query_lower or 'month' in query_lower:
-                # Revenue trend over time
-                monthly_revenue = df.groupby(df['Date'].dt.to_period('M'))['Revenue'].sum().reset_index()
-                monthly_revenue['Date'] = monthly_revenue['Date'].astype(str)
-                
-                fig = px.line(
-                    monthly_revenue,
-                    x='Date',
-                    y='Revenue',
-                    title="Monthly Revenue Trend",
-                    template="plotly_dark"
-                )
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                )
-                
-                total_revenue = df['Revenue'].sum()
-                avg_monthly = monthly_revenue['Revenue'].mean()
-                
-                response = {
-                    "role": "assistant",
-                    "content": f"📈 **Revenue Analysis:**\n\n• **Total Revenue:** ${total_revenue:,.2f}\n• **Average Monthly:** ${avg_monthly:,.2f}\n• **Best Month:** {monthly_revenue.loc[monthly_revenue['Revenue'].idxmax(), 'Date']}",
-                    "chart": fig,
-                    "dataframe": monthly_revenue,
-                    "code": "df.groupby(df['Date'].dt.to_period('M'))['Revenue'].sum()"
-                }
-                return response
-            
-            elif any(word in query_lower for word in ['category', 'product']):
-                # Revenue by category
-                category_revenue = df.groupby('Product_Category')['Revenue'].sum().sort_values(ascending=False)
-                
-                fig = px.bar(
-                    x=category_revenue.values,
-                    y=category_revenue.index,
-                    orientation='h',
-                    title="Revenue by Product Category",
-                    template="plotly_dark",
-                    labels={'x': 'Revenue', 'y': 'Category'}
-                )
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                )
-                
-                response = {
-                    "role": "assistant",
-                    "content": f"💰 **Revenue by Category:**\n\nTop performer: **{category_revenue.index[0]}** (${category_revenue.iloc[0]:,.2f})",
-                    "chart": fig,
-                    "dataframe": pd.DataFrame({"Revenue": category_revenue}),
-                    "code": "df.groupby('Product_Category')['Revenue'].sum().sort_values(ascending=False)"
-                }
-                return response
-        
-        # Top products/categories
-        elif any(word in query_lower for word in ['top', 'best', 'highest']):
-            if 'category' in query_lower or 'product' in query_lower:
-                top_categories = df.groupby('Product_Category')['Revenue'].sum().sort_values(ascending=False).head(5)
-                
-                fig = px.pie(
-                    values=top_categories.values,
-                    names=top_categories.index,
-                    title="Top 5 Product Categories by Revenue",
-                    template="plotly_dark"
-                )
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                )
-                
-                response = {
-                    "role": "assistant",
-                    "content": f"🏆 **Top 5 Product Categories:**\n\n1. **{top_categories.index[0]}**: ${top_categories.iloc[0]:,.2f}",
-                    "chart": fig,
-                    "dataframe": pd.DataFrame({"Revenue": top_categories}),
-                    "code": "df.groupby('Product_Category')['Revenue'].sum().sort_values(ascending=False).head(5)"
-                }
-                return response
-        
-        # Customer analysis
-        elif any(word in query_lower for word in ['customer', 'new', 'returning']):
-            customer_analysis = df.groupby('Customer_Type').agg({
-                'Revenue': 'sum',
-                'Units_Sold': 'sum'
-            }).reset_index()
-            
-            fig = px.bar(
-                customer_analysis,
-                x='Customer_Type',
-                y='Revenue',
-                title="Revenue by Customer Type",
-                template="plotly_dark"
-            )
-            fig.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-            )
-            
-            response = {
-                "role": "assistant",
-                "content": "👥 **Customer Type Analysis:**\n\nBreaking down performance by customer type...",
-                "chart": fig,
-                "dataframe": customer_analysis,
-                "code": "df.groupby('Customer_Type').agg({'Revenue': 'sum', 'Units_Sold': 'sum'})"
-            }
-            return response
-        
-        # Regional analysis
-        elif any(word in query_lower for word in ['region', 'location', 'geographic']):
-            regional_data = df.groupby('Region')['Revenue'].sum().sort_values(ascending=False)
-            
-            fig = px.bar(
-                x=regional_data.index,
-                y=regional_data.values,
-                title="Revenue by Region",
-                template="plotly_dark",
-                labels={'x': 'Region', 'y': 'Revenue'}
-            )
-            fig.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-            )
-            
-            response = {
-                "role": "assistant",
-                "content": f"🌍 **Regional Performance:**\n\nTop region: **{regional_data.index[0]}** with ${regional_data.iloc[0]:,.2f}",
-                "chart": fig,
-                "dataframe": pd.DataFrame({"Revenue": regional_data}),
-                "code": "df.groupby('Region')['Revenue'].sum().sort_values(ascending=False)"
-            }
-            return response
-        
-        # Summary/overview
-        elif any(word in query_lower for word in ['summary', 'overview', 'describe']):
-            total_revenue = df['Revenue'].sum()
-            total_units = df['Units_Sold'].sum()
-            avg_rating = df['Rating'].mean()
-            date_range = f"{df['Date'].min().date()} to {df['Date'].max().date()}"
-            
-            response = {
-                "role": "assistant",
-                "content": f"""📊 **Dataset Overview:**
-
-• **Time Period:** {date_range}
-• **Total Revenue:** ${total_revenue:,.2f}
-• **Units Sold:** {total_units:,}
-• **Average Rating:** {avg_rating:.1f}/5
-• **Product Categories:** {df['Product_Category'].nunique()}
-• **Regions:** {df['Region'].nunique()}
-• **Records:** {len(df):,}""",
-                "dataframe": df.head(max_rows),
-                "code": "df.describe()"
-            }
-            return response
-        
-        # Default response
-        response = {
-            "role": "assistant",
-            "content": f"""🤔 I'd love to help analyze: "{query}"
-
-Here are some things you can ask me:
-
-**📈 Revenue & Sales:**
-• "Show me revenue trends over time"
-• "Which product category generates the most revenue?"
-
-**🏆 Performance:**
-• "What are the top performing regions?"
-• "Compare new vs returning customers"
-
-**📊 General:**
-• "Give me a summary of the data"
-• "Show me customer ratings analysis"
-
-What would you like to explore?"""
-        }
-        
-        return response
-        
-    except Exception as e:
-        return {
-            "role": "assistant", 
-            "content": f"❌ I encountered an error: {str(e)}\n\nTry asking for a 'summary' or be more specific about what you'd like to analyze."
-        }
-
 # Main app logic
 if not st.session_state.authenticated:
     login_screen()
+    metrics.record_startup("login_render", time.perf_counter() - SCRIPT_STARTED)
 else:
     chat_interface()
\ No newline at end of file
@@ -0,0 +1,11 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def gate():
+    """Event jobs block on until the test releases them; released at teardown"""
+    event = threading.Event()
+    yield event
+    event.set()
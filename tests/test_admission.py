@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+import admission
+from admission import RateLimiter
+from execution import DONE, QUEUED, RUNNING, QueryExecutor
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen monotonic clock the tests move forward by hand"""
+    now = [1_000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_a_full_bucket_admits_a_burst_without_delay(clock):
+    limiter = RateLimiter(rate=1.0, burst=5.0, max_wait=3.0)
+    assert [limiter.reserve("ann", 1.0) for _ in range(5)] == [(True, 0.0)] * 5
+
+
+def test_over_budget_questions_are_delayed_then_refused(clock):
+    limiter = RateLimiter(rate=1.0, burst=5.0, max_wait=3.0)
+    limiter.reserve("ann", 5.0)
+    assert limiter.reserve("ann", 2.0) == (True, 2.0)
+    # Tokens taken on credit push later questions further back
+    admitted, retry_in = limiter.reserve("ann", 2.0)
+    assert not admitted and retry_in == pytest.approx(1.0)
+    assert limiter.stats() == {"users": 1, "delayed": 1, "rejected": 1}
+
+
+def test_buckets_refill_over_time_and_are_per_user(clock):
+    limiter = RateLimiter(rate=2.0, burst=4.0, max_wait=0.0)
+    limiter.reserve("ann", 4.0)
+    assert limiter.reserve("bob", 4.0) == (True, 0.0)
+    assert not limiter.reserve("ann", 1.0)[0]
+    clock[0] += 1.0
+    assert limiter.reserve("ann", 2.0) == (True, 0.0)
+
+
+def test_expensive_questions_are_charged_at_most_a_full_bucket(clock):
+    limiter = RateLimiter(rate=1.0, burst=5.0, max_wait=3.0)
+    assert limiter.reserve("ann", 50.0) == (True, 0.0)
+    assert limiter.reserve("ann", 1.0) == (True, 1.0)
+
+
+def test_refunds_restore_tokens_up_to_the_burst(clock):
+    limiter = RateLimiter(rate=1.0, burst=5.0, max_wait=0.0)
+    limiter.reserve("ann", 5.0)
+    limiter.refund("ann", 50.0)
+    assert limiter.reserve("ann", 5.0) == (True, 0.0)
+    assert not limiter.reserve("ann", 1.0)[0]
+
+
+def test_heavy_jobs_leave_a_worker_for_cheap_ones(gate):
+    executor = QueryExecutor(max_workers=2, heavy_cost=5.0)
+    assert executor.heavy_limit == 1
+    heavy = [executor.submit(user, gate.wait, 5, cost=10.0) for user in ("ann", "bob")]
+    cheap = executor.submit("cat", lambda: "quick", cost=1.0)
+    deadline = time.monotonic() + 5
+    job = executor.poll(cheap)
+    while job["status"] != DONE and time.monotonic() < deadline:
+        time.sleep(0.01)
+        job = executor.poll(cheap)
+    assert job["result"] == "quick"
+    assert [executor.poll(job_id)["status"] for job_id in heavy] == [RUNNING, QUEUED]
+    assert executor.stats()["heavy_running"] == 1
+
+
+def test_heavy_jobs_are_shed_while_the_queue_is_full(gate):
+    executor = QueryExecutor(max_workers=1, max_queued=2)
+    for user in ("ann", "bob", "cat"):
+        executor.submit(user, gate.wait, 5)
+    assert executor.submit("dan", gate.wait, 5, cost=10.0) is None
+    # Cheap questions are still queued
+    assert executor.submit("dan", gate.wait, 5) is not None
+    assert executor.stats()["shed"] == 1
+
+
+def test_delayed_jobs_start_once_due():
+    executor = QueryExecutor(max_workers=2, timeout=1.0)
+    job_id = executor.submit("ann", time.monotonic, delay=0.3)
+    submitted = time.monotonic()
+    job = executor.poll(job_id)
+    assert job["status"] == QUEUED and 0 < job["starts_in"] <= 0.3
+    deadline = submitted + 5
+    while job["status"] != DONE and time.monotonic() < deadline:
+        time.sleep(0.02)
+        job = executor.poll(job_id)
+    assert job["result"] - submitted >= 0.25
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import approximate
+from approximate import (
+    MARGIN_SUFFIX, build_sample, estimate_plan, hll_estimate, hll_sketches, merge_sketches, weighted_quantile,
+)
+from dataset_engine import RollupCache, create_sample_dataset, normalize_dataset
+from planner import new_plan
+
+
+@pytest.fixture(scope="module")
+def frame():
+    frame, _ = normalize_dataset(create_sample_dataset(40_000, seed=7))
+    return frame
+
+
+@pytest.fixture(autouse=True)
+def small_sample(monkeypatch):
+    # 2,000 of 40,000 rows: sampled at 5%, like 100,000 of 2 million
+    monkeypatch.setattr(approximate, "SAMPLE_ROWS", 2_000)
+
+
+def plan_for(agg, measures, dimensions=()):
+    return dict(new_plan(), measures=list(measures), agg=agg, dimensions=list(dimensions))
+
+
+def estimate(frame, plan, seed=0):
+    rollups = RollupCache(frame)
+    rollups.cached(("sample",), lambda: build_sample(rollups, seed))
+    return estimate_plan(plan, rollups)
+
+
+def test_sample_is_stratified_by_month(frame):
+    rollups = RollupCache(frame)
+    sample = build_sample(rollups)
+    assert len(sample.population) == 12
+    assert sample.population.sum() == len(frame)
+    assert (sample.sampled >= approximate.MIN_STRATUM_ROWS * 0.5).all()
+    # Weights scale every stratum back to its population
+    weights = sample.weights.groupby(sample.frame[approximate.STRATUM], observed=True).sum()
+    np.testing.assert_allclose(weights.reindex(sample.population.index), sample.population)
+
+
+@pytest.mark.parametrize("agg", ['sum', 'size', 'mean'])
+def test_intervals_cover_the_exact_answer_about_95_percent_of_the_time(frame, agg):
+    plan = plan_for(agg, ['Revenue'], ['Region'])
+    exact = frame.groupby('Region', observed=True)['Revenue'].agg(agg)
+    covered = []
+    for seed in range(40):
+        result = estimate(frame, plan, seed)
+        error = (result['Revenue'] - exact.reindex(result.index)).abs()
+        covered.extend(error <= result['Revenue' + MARGIN_SUFFIX])
+    assert 0.85 <= np.mean(covered) <= 1.0
+
+
+def test_fully_sampled_datasets_are_answered_exactly(frame, monkeypatch):
+    monkeypatch.setattr(approximate, "SAMPLE_ROWS", len(frame))
+    result = estimate(frame, plan_for('sum', ['Revenue'], ['Region']))
+    exact = frame.groupby('Region', observed=True)['Revenue'].sum()
+    np.testing.assert_allclose(result['Revenue'].sort_index(), exact.sort_index())
+    assert (result['Revenue' + MARGIN_SUFFIX] == 0).all()
+
+
+def test_median_estimate_is_close_with_a_positive_margin(frame):
+    result = estimate(frame, plan_for('median', ['Revenue']))
+    value, margin = result['Revenue'].iloc[0], result['Revenue' + MARGIN_SUFFIX].iloc[0]
+    assert margin > 0
+    assert abs(value - frame['Revenue'].median()) <= 2 * margin
+
+
+def test_weighted_quantile_repeats_values_by_weight():
+    values, weights = np.array([1.0, 2.0, 3.0]), np.array([1.0, 1.0, 8.0])
+    assert weighted_quantile(values, weights, 0.5) == 3.0
+    assert weighted_quantile(values, np.ones(3), 0.5) == 2.0
+
+
+def test_extended_sample_counts_the_appended_rows(frame):
+    rollups = RollupCache(frame)
+    sample = build_sample(rollups)
+    extended = sample.extended(frame.head(1_000), np.random.default_rng(0))
+    assert extended.population.sum() == len(frame) + 1_000
+    assert len(extended.frame) >= len(sample.frame)
+    pd.testing.assert_series_equal(extended.rates, sample.rates)
+
+
+@pytest.mark.parametrize("distinct", [10, 1_000, 100_000])
+def test_hyperloglog_counts_within_its_margin(distinct):
+    values = pd.Series(np.arange(distinct) * 7919).repeat(3)
+    (registers,) = hll_sketches(pd.DataFrame({'value': values}), None, 'value').values()
+    estimated, margin = hll_estimate(registers)
+    assert abs(estimated - distinct) <= max(margin, 1)
+
+
+def test_merged_sketches_equal_a_sketch_of_all_rows():
+    chunk = pd.DataFrame({'group': np.repeat(['a', 'b'], 5_000), 'value': np.arange(10_000) % 3_000})
+    whole = hll_sketches(chunk, 'group', 'value')
+    merged = merge_sketches(hll_sketches(chunk.iloc[:4_000], 'group', 'value'),
+                            hll_sketches(chunk.iloc[4_000:], 'group', 'value'))
+    assert merged.keys() == whole.keys()
+    for group in whole:
+        np.testing.assert_array_equal(merged[group], whole[group])
+
+
+def test_distinct_estimates_are_grouped(frame):
+    result = estimate(frame, plan_for('nunique', ['Revenue'], ['Region']))
+    exact = frame.groupby('Region', observed=True)['Revenue'].nunique()
+    error = (result['Revenue'] - exact.reindex(result.index)).abs()
+    assert (error <= result['Revenue' + MARGIN_SUFFIX]).all()
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from charts import MAX_CHART_POINTS, MAX_SERIES, OTHER_LABEL, prepare_chart_data
+from planner import new_plan
+
+
+def daily_series(count, days=365):
+    dates = pd.period_range('2024-01-01', periods=days, freq='D')
+    return pd.DataFrame({
+        'Date': np.tile(dates, count),
+        'Store': np.repeat([f"store {i}" for i in range(count)], days),
+        'Revenue': np.random.default_rng(0).random(count * days),
+    })
+
+
+def line_query(agg='sum'):
+    return dict(new_plan(), measures=['Revenue'], agg=agg, time='Date', grain='D', dimensions=['Store'])
+
+
+@pytest.mark.parametrize("count", [50, 2_000])
+def test_many_series_stay_within_the_point_budget(count):
+    data, note, _ = prepare_chart_data(daily_series(count), {"type": "line"}, line_query())
+    assert len(data) <= MAX_CHART_POINTS
+    assert data['Store'].nunique() == MAX_SERIES + 1
+    assert f"top {MAX_SERIES} of {count:,} series + {OTHER_LABEL}" in note
+
+
+def test_folded_series_sum_the_rest_per_bucket():
+    source = daily_series(30, days=10)
+    data, _, _ = prepare_chart_data(source, {"type": "line"}, line_query())
+    kept = data[data['Store'] != OTHER_LABEL]
+    other = data[data['Store'] == OTHER_LABEL]
+    assert other['Revenue'].sum() == pytest.approx(source['Revenue'].sum() - kept['Revenue'].sum())
+    assert len(other) == 10
+
+
+def test_folded_series_are_dropped_for_non_additive_aggregations():
+    data, note, _ = prepare_chart_data(daily_series(30, days=10), {"type": "line"}, line_query('mean'))
+    assert OTHER_LABEL not in set(data['Store'])
+    assert data['Store'].nunique() == MAX_SERIES and OTHER_LABEL not in note
+
+
+def test_few_series_are_left_alone():
+    source = daily_series(3, days=10)
+    data, note, _ = prepare_chart_data(source, {"type": "line"}, line_query())
+    assert note == "" and len(data) == len(source)
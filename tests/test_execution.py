@@ -0,0 +1,108 @@
+import time
+
+from execution import CANCELLED, DONE, FAILED, QUEUED, RUNNING, TIMED_OUT, QueryExecutor
+
+
+def wait_for(executor, job_id, states, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = executor.poll(job_id)
+        if job["status"] in states or time.monotonic() > deadline:
+            return job
+        time.sleep(0.01)
+
+
+def blocked(gate, value=None):
+    gate.wait(5)
+    return value
+
+
+def test_jobs_run_in_the_background_and_report_their_result():
+    executor = QueryExecutor(max_workers=2)
+    job = wait_for(executor, executor.submit("ann", lambda x: x * 2, 21), (DONE,))
+    assert job["status"] == DONE and job["result"] == 42
+    # Final results are handed out once
+    assert executor.poll(job["id"]) is None
+
+
+def test_failures_are_reported_with_their_exception():
+    def fail():
+        raise ValueError("boom")
+
+    executor = QueryExecutor()
+    job = wait_for(executor, executor.submit("ann", fail), (FAILED,))
+    assert job["status"] == FAILED and isinstance(job["error"], ValueError)
+    assert executor.stats()["running"] == 0
+
+
+def test_a_user_runs_one_job_at_a_time(gate):
+    executor = QueryExecutor(max_workers=4, per_user_limit=1)
+    first = executor.submit("ann", blocked, gate)
+    second = executor.submit("ann", blocked, gate)
+    assert wait_for(executor, first, (RUNNING,))["status"] == RUNNING
+    assert executor.poll(second)["status"] == QUEUED
+    gate.set()
+    assert wait_for(executor, second, (DONE,))["status"] == DONE
+
+
+def test_waiting_users_take_turns(gate):
+    executor = QueryExecutor(max_workers=1, per_user_limit=1)
+    started = []
+
+    def job(name):
+        started.append(name)
+        gate.wait(5)
+
+    blocker = executor.submit("zoe", job, "zoe")
+    wait_for(executor, blocker, (RUNNING,))
+    # Ann queues three questions before Bob asks one; Bob still goes second
+    ids = [executor.submit("ann", job, f"ann{i}") for i in range(3)] + [executor.submit("bob", job, "bob")]
+    assert executor.poll(ids[-1])["ahead"] == 3
+    gate.set()
+    for job_id in ids:
+        wait_for(executor, job_id, (DONE,))
+    assert started == ["zoe", "ann0", "bob", "ann1", "ann2"]
+
+
+def test_cancelling_a_queued_job_frees_its_place(gate):
+    executor = QueryExecutor(max_workers=1)
+    running = executor.submit("ann", blocked, gate)
+    queued = executor.submit("bob", blocked, gate)
+    executor.cancel(queued)
+    assert executor.poll(queued) is None
+    assert executor.stats()["queued"] == 0
+    gate.set()
+    assert wait_for(executor, running, (DONE,))["status"] == DONE
+
+
+def test_streaming_jobs_publish_partials_and_stop_when_cancelled(gate):
+    executor = QueryExecutor(max_workers=1)
+    produced = []
+
+    def stream():
+        for step in range(3):
+            produced.append(step)
+            yield step
+            gate.wait(5)
+
+    job_id = executor.submit("ann", stream)
+    deadline = time.monotonic() + 5
+    while executor.poll(job_id)["partial"] != 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    executor.cancel(job_id)
+    gate.set()
+    time.sleep(0.1)
+    assert produced == [0, 1]
+
+
+def test_jobs_that_run_too_long_time_out(gate):
+    executor = QueryExecutor(max_workers=1, timeout=0.1)
+    job = wait_for(executor, executor.submit("ann", blocked, gate), (TIMED_OUT,))
+    assert job["status"] == TIMED_OUT
+
+
+def test_a_timed_out_job_does_not_hold_its_user_back_once_finished(gate):
+    executor = QueryExecutor(max_workers=1, timeout=0.1)
+    wait_for(executor, executor.submit("ann", blocked, gate), (TIMED_OUT, CANCELLED))
+    gate.set()
+    assert wait_for(executor, executor.submit("ann", lambda: "next"), (DONE,))["result"] == "next"
@@ -0,0 +1,34 @@
+import pytest
+
+from history import ConversationStore, SQLiteStore
+
+
+def test_stores_must_implement_every_method():
+    class Partial(ConversationStore):
+        def append(self, user, message):
+            return 1
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_sqlite_store_pages_back_through_a_conversation():
+    store = SQLiteStore(":memory:")
+    ids = [store.append("ann", {"role": "user", "content": f"q{i}"}) for i in range(5)]
+    store.append("bob", {"role": "user", "content": "other"})
+
+    latest = store.load("ann", limit=2)
+    assert [message["content"] for message in latest] == ["q3", "q4"]
+    assert [message["id"] for message in latest] == ids[3:]
+    assert [message["content"] for message in store.load("ann", before=ids[3], limit=2)] == ["q1", "q2"]
+    assert store.count("ann") == 5 and store.count("ann", before=ids[3]) == 3
+
+    store.clear("ann")
+    assert store.load("ann") == [] and store.count("bob") == 1
+
+
+def test_transient_keys_are_not_stored():
+    store = SQLiteStore(":memory:")
+    store.append("ann", {"role": "assistant", "content": "hi", "stage": "table", "id": 99})
+    (message,) = store.load("ann")
+    assert "stage" not in message and message["id"] != 99
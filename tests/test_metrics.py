@@ -0,0 +1,25 @@
+import metrics
+from metrics import BUCKETS, Histogram
+
+
+def test_quantiles_fall_on_bucket_bounds():
+    histogram = Histogram()
+    for seconds in (0.002, 0.002, 0.04, 0.3):
+        histogram.observe(seconds)
+    assert histogram.quantile(0.5) == 0.0025
+    assert histogram.quantile(0.99) == 0.5
+
+
+def test_overflow_quantiles_are_clamped_to_the_largest_bound():
+    histogram = Histogram()
+    histogram.observe(120.0)
+    assert histogram.quantile(0.99) == BUCKETS[-1]
+
+
+def test_the_endpoint_listens_on_loopback_by_default():
+    server = metrics.serve(0)
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from parallel import partitions
+from planner import finalize_partial, merge_partials, new_plan, partial_aggregate
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    rows = 1_000
+    return pd.DataFrame({
+        'Date': pd.date_range('2024-01-01', periods=rows, freq='6h'),
+        'Region': pd.Categorical(rng.choice(['North', 'South', 'East', 'West'], rows)),
+        'Customer': rng.integers(0, 50, rows),
+        'Revenue': rng.normal(100, 30, rows).round(2),
+    })
+
+
+def plan_for(agg, measures, dimensions=(), time=None, grain=None):
+    return dict(new_plan(), measures=list(measures), agg=agg, dimensions=list(dimensions), time=time, grain=grain)
+
+
+def merged(frame, plan, parts=4):
+    """Partial aggregates of `parts` row ranges, merged and finalized"""
+    partials = [partial_aggregate(frame.iloc[start:stop], plan) for start, stop in partitions(frame, parts, 'Date')]
+    return finalize_partial(merge_partials(partials, plan), plan)
+
+
+@pytest.mark.parametrize("agg", ['sum', 'size', 'count', 'min', 'max', 'mean'])
+def test_merged_partials_match_a_single_pass(frame, agg):
+    plan = plan_for(agg, ['Revenue'], ['Region'])
+    expected = frame.groupby('Region', observed=True)['Revenue'].agg(agg).sort_index()
+    pd.testing.assert_series_equal(merged(frame, plan)['Revenue'], expected, check_dtype=False, check_names=False)
+
+
+def test_mean_is_merged_from_sums_and_counts(frame):
+    plan = plan_for('mean', ['Revenue'])
+    partial = partial_aggregate(frame.iloc[:10], plan)
+    assert list(partial.columns) == ['Revenue__sum', 'Revenue__count']
+    # Averaging the partition means would weight a small partition like a large one
+    halves = [partial_aggregate(frame.iloc[:10], plan), partial_aggregate(frame.iloc[10:], plan)]
+    result = finalize_partial(merge_partials(halves, plan), plan)
+    assert result['Revenue'].iloc[0] == pytest.approx(frame['Revenue'].mean())
+
+
+def test_distinct_counts_union_values_seen_in_several_partitions(frame):
+    plan = plan_for('nunique', ['Customer'], ['Region'])
+    expected = frame.groupby('Region', observed=True)['Customer'].nunique().sort_index()
+    result = merged(frame, plan, parts=8)['Customer']
+    pd.testing.assert_series_equal(result, expected, check_dtype=False, check_names=False)
+    # Summing per-partition distinct counts would count repeat customers again
+    per_partition = sum(
+        partial_aggregate(frame.iloc[start:stop], plan)['Customer'].map(len)
+        for start, stop in partitions(frame, 8, 'Date')
+    )
+    assert (per_partition > result).all()
+
+
+def test_min_and_max_span_partitions(frame):
+    frame.loc[3, 'Revenue'], frame.loc[997, 'Revenue'] = -1_000.0, 1_000.0
+    for agg, expected in (('min', -1_000.0), ('max', 1_000.0)):
+        assert merged(frame, plan_for(agg, ['Revenue']))['Revenue'].iloc[0] == expected
+
+
+def test_time_buckets_split_across_partitions_are_merged(frame):
+    plan = plan_for('sum', ['Revenue'], time='Date', grain='M')
+    expected = frame.groupby(frame['Date'].dt.to_period('M'))['Revenue'].sum()
+    result = merged(frame, plan, parts=7)['Revenue']
+    assert result.index.is_unique
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy())
+
+
+def test_partitions_start_on_day_boundaries(frame):
+    ranges = partitions(frame, 4, 'Date')
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(frame)
+    for start, _ in ranges[1:]:
+        assert frame['Date'].iloc[start] == frame['Date'].iloc[start].normalize()
@@ -0,0 +1,19 @@
+from analytics import ResultCache
+
+
+def test_reloads_keep_results_already_built_for_the_new_version():
+    cache = ResultCache()
+    cache.get_or_build("old", lambda: 1, "sales", 1)
+    cache.get_or_build("new", lambda: 2, "sales", 2)
+    cache.get_or_build("other", lambda: 3, "stores", 1)
+    cache.invalidate("sales", before=2)
+    assert "old" not in cache
+    assert "new" in cache and "other" in cache
+
+
+def test_invalidating_without_a_version_drops_every_entry_of_the_dataset():
+    cache = ResultCache()
+    cache.get_or_build("old", lambda: 1, "sales", 1)
+    cache.get_or_build("new", lambda: 2, "sales", 2)
+    cache.invalidate("sales")
+    assert cache.stats()["entries"] == 0
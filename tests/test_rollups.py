@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from dataset_engine import RollupCache
+
+
+@pytest.fixture
+def rollups():
+    return RollupCache(pd.DataFrame({'Region': ['North', 'South', 'North'], 'Revenue': [1.0, 2.0, 3.0]}))
+
+
+def test_keys_build_concurrently(rollups, gate):
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        gate.wait(5)
+        return "slow"
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        heavy = pool.submit(rollups.cached, ("heavy",), slow)
+        assert started.wait(5)
+        # Not held up by the build still running on the same dataset
+        assert rollups.get('Region', 'Revenue')['North'] == 4.0
+        assert not heavy.done()
+        gate.set()
+        assert heavy.result(5) == "slow"
+
+
+def test_concurrent_requests_for_a_key_share_one_build(rollups, gate):
+    builds = []
+
+    def build():
+        builds.append(1)
+        gate.wait(5)
+        return len(builds)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(rollups.cached, ("shared",), build) for _ in range(8)]
+        gate.set()
+        assert [future.result(5) for future in futures] == [1] * 8
+    assert builds == [1]
+
+
+def test_failed_builds_are_not_cached(rollups):
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        rollups.cached(("flaky",), fail)
+    assert ("flaky",) not in rollups
+    assert rollups.cached(("flaky",), lambda: "ok") == "ok"
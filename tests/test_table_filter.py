@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+from analytics import parse_table_filter
+from dataset_engine import ArrowBackend, InMemoryBackend, create_sample_dataset, normalize_dataset
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    frame, _ = normalize_dataset(create_sample_dataset(2_000))
+    path = tmp_path_factory.mktemp("data") / "sales.parquet"
+    frame.to_parquet(path)
+    return InMemoryBackend(frame), ArrowBackend(str(path))
+
+
+def matching_rows(backend, text):
+    filters, error = parse_table_filter(text, backend.dtypes)
+    assert error is None
+    rows, total = backend.page(filters, sort='Revenue', offset=0, limit=10_000)
+    rows = rows if isinstance(rows, pd.DataFrame) else rows.to_pandas()
+    assert len(rows) == total
+    return sorted(map(tuple, rows.astype(str).to_numpy()))
+
+
+@pytest.mark.parametrize("text", [
+    "Region = North, South",
+    "Rating = 5",
+    "Rating = 4.0",
+    "Date = 2024-01-05",
+    "Date = 2024-01-05, 2024-02-10; Customer_Type = New",
+    "Units_Sold = 3; region = East",
+])
+def test_both_backends_match_the_same_rows(backends, text):
+    in_memory, arrow = backends
+    rows = matching_rows(in_memory, text)
+    assert rows
+    assert matching_rows(arrow, text) == rows
+
+
+@pytest.mark.parametrize("text", ["Rating = abc", "Rating = 4.5", "Date = soon", "Revenue = lots"])
+def test_values_of_the_wrong_type_are_reported_not_raised(backends, text):
+    for backend in backends:
+        filters, error = parse_table_filter(text, backend.dtypes)
+        assert filters == {} and "is not a valid" in error
+
+
+def test_unknown_columns_are_reported(backends):
+    filters, error = parse_table_filter("Colour = red", backends[0].dtypes)
+    assert filters == {} and error.startswith("Use 'Column = value, value'")
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_engine import RollupCache
+from time_index import TimeIndex
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(1)
+    rows = 2_000
+    dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 400, rows)), unit='D')
+    revenue = rng.normal(100, 30, rows).round(2)
+    # Missing values count as rows but not towards the measure's count
+    revenue[::17] = np.nan
+    return pd.DataFrame({'Date': dates, 'Revenue': revenue})
+
+
+@pytest.fixture
+def index(frame):
+    return TimeIndex(RollupCache(frame), 'Date', ['Revenue'])
+
+
+def in_range(frame, start, end):
+    return frame[(frame['Date'] >= start) & (frame['Date'] < end)]
+
+
+@pytest.mark.parametrize("start,end", [
+    ('2024-01-01', '2025-02-05'),
+    ('2024-03-01', '2024-04-01'),
+    ('2024-02-29', '2024-03-01'),
+    # Bounds falling on days without rows
+    ('2023-06-01', '2024-01-15'),
+    ('2025-01-20', '2030-01-01'),
+])
+@pytest.mark.parametrize("agg", ['sum', 'size', 'count', 'mean'])
+def test_totals_match_a_scan_of_the_range(frame, index, start, end, agg):
+    rows = in_range(frame, pd.Timestamp(start), pd.Timestamp(end))['Revenue']
+    assert index.total('Revenue', agg, start, end) == pytest.approx(rows.agg(agg))
+
+
+def test_total_of_an_empty_range_is_zero_or_missing(index):
+    assert index.total('Revenue', 'sum', '2030-01-01', '2031-01-01') == 0
+    assert index.total('Revenue', 'size', '2024-05-01', '2024-04-01') == 0
+    assert np.isnan(index.total('Revenue', 'mean', '2030-01-01', '2031-01-01'))
+
+
+@pytest.mark.parametrize("grain", ['D', 'W', 'M', 'Q', 'Y'])
+def test_series_match_a_grouped_scan(frame, index, grain):
+    start, end = pd.Timestamp('2024-02-10'), pd.Timestamp('2024-11-20')
+    rows = in_range(frame, start, end)
+    expected = rows.groupby(rows['Date'].dt.to_period(grain))['Revenue'].sum()
+    result = index.series('Revenue', 'sum', grain, start, end)
+    assert list(result.index) == list(expected.index)
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy())
+
+
+def test_series_buckets_are_cut_at_the_range_bounds(frame, index):
+    # The first and last months are partial: only their days inside the range count
+    result = index.series('Revenue', 'size', 'M', '2024-03-15', '2024-05-10')
+    assert list(result.index.astype(str)) == ['2024-03', '2024-04', '2024-05']
+    assert result.iloc[0] == len(in_range(frame, pd.Timestamp('2024-03-15'), pd.Timestamp('2024-04-01')))
+
+
+def test_series_of_an_empty_range_is_empty(index):
+    assert index.series('Revenue', 'sum', 'M', '2030-01-01', '2030-06-01').empty
+
+
+def test_answers_only_additive_aggregations_of_indexed_measures(index):
+    assert index.answers(['Revenue'], 'mean')
+    assert index.answers(['Units'], 'size')
+    assert not index.answers(['Units'], 'sum')
+    assert not index.answers(['Revenue'], 'median')